@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .. import report
+from ..cache import DirectoryIndex, StatusCache
+from ..file_utils import exhaustive_directory_search, search_tail
+from ..report import generate_report
+
+
+def _age_directories(root, seconds=3600):
+    """Pushes back the modification times of every directory in the tree, so
+    that the index considers them trustworthy."""
+
+    for dirpath, _, _ in os.walk(root):
+        st = os.stat(dirpath)
+        os.utime(dirpath, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_directory_index(DummyDirectories, monkeypatch):
+    with DummyDirectories() as tmpdir, TemporaryDirectory() as cachedir:
+        index_path = Path(cachedir) / Path("index.json")
+        _age_directories(tmpdir)
+        index = DirectoryIndex.load(index_path)
+        expected = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", max_workers=1, index=index
+        )
+        index.save()
+
+        # Nothing changed, so nothing should be listed again
+        calls = []
+        scandir = os.scandir
+
+        def counting_scandir(path):
+            calls.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", counting_scandir)
+        index = DirectoryIndex.load(index_path)
+        res = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", max_workers=1, index=index
+        )
+        index.save()
+        assert res == expected
+        assert calls == []
+
+        # Adding a new calculation only lists the modified directory
+        new = Path(tmpdir) / Path("new")
+        new.mkdir()
+        (new / Path("submit.sbatch")).touch()
+        index = DirectoryIndex.load(index_path)
+        res = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", max_workers=4, index=index
+        )
+        assert res == sorted(expected + [new])
+        assert set(calls) == {tmpdir, str(new)}
+
+
+def _age_files(root, seconds=3600):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            st = os.stat(path)
+            os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_status_cache(DummyDirectories, monkeypatch):
+    with DummyDirectories() as tmpdir, TemporaryDirectory() as cachedir:
+        cache_path = Path(cachedir) / Path("status.json")
+        _age_files(tmpdir)
+        cache = StatusCache.load(cache_path)
+        expected = generate_report(tmpdir, "submit.sbatch", cache=cache)
+        cache.save()
+        assert len(StatusCache.load(cache_path)) == 2
+
+        reads = []
+
+        def counting_search_tail(path, *args, **kwargs):
+            reads.append(Path(path).name)
+            return search_tail(path, *args, **kwargs)
+
+        monkeypatch.setattr(report, "search_tail", counting_search_tail)
+        cache = StatusCache.load(cache_path)
+        assert generate_report(tmpdir, "submit.sbatch", cache=cache) == expected
+        assert reads == []
+
+        # Truncating the OUTCAR invalidates only the VASP verdict
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        outcar.write_text("running\n")
+        res = generate_report(tmpdir, "submit.sbatch", cache=cache)
+        assert reads == ["OUTCAR"]
+        assert res["VASP"]["fail"] == [str(outcar.parent)]
@@ -0,0 +1,127 @@
+import bz2
+import gzip
+import lzma
+from pathlib import Path
+
+import pytest
+
+from .. import compression
+from ..compression import (
+    GzipSeekIndex,
+    scan_compressed,
+    search_tail_compressed,
+    tail_compressed,
+)
+from ..file_utils import SignatureMatcher, tail, scan_file, search_tail
+from ..report import (
+    CONFIG,
+    check_job_status,
+    diagnose_job,
+    generate_report,
+)
+
+CONTENT = b"".join(b"line %d\n" % ii for ii in range(20000))
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(compression, "CHUNK_SIZE", 1000)
+
+
+def _write(path):
+    if path.suffix == ".gz":
+        # Two members, to exercise the member boundary handling
+        half = len(CONTENT) // 2
+        path.write_bytes(
+            gzip.compress(CONTENT[:half]) + gzip.compress(CONTENT[half:])
+        )
+    elif path.suffix == ".xz":
+        path.write_bytes(lzma.compress(CONTENT))
+    elif path.suffix == ".bz2":
+        path.write_bytes(bz2.compress(CONTENT))
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".xz", ".bz2"])
+def test_tail_compressed(tmp_path, small_chunks, suffix):
+    plain = tmp_path / "OUTCAR"
+    plain.write_bytes(CONTENT)
+    path = tmp_path / f"OUTCAR{suffix}"
+    _write(path)
+    for n_lines, max_bytes in [(1, None), (100, None), (None, 50), (5, 10)]:
+        expected = tail(plain, n_lines, max_bytes)
+        assert tail_compressed(path, n_lines, max_bytes) == expected
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".xz", ".bz2"])
+def test_scan_compressed(tmp_path, small_chunks, suffix):
+    plain = tmp_path / "OUTCAR"
+    plain.write_bytes(CONTENT)
+    path = tmp_path / f"OUTCAR{suffix}"
+    _write(path)
+    matcher = SignatureMatcher(["line 1", "line 19999\n", "line 5000\n"])
+    for start, end in [(None, None), (-12, None), (100, 200), (0, -100000)]:
+        for count in [False, True]:
+            expected = scan_file(plain, matcher, start, end, count)
+            assert scan_compressed(path, matcher, start, end, count) == expected
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".xz"])
+def test_search_tail_compressed(tmp_path, small_chunks, suffix):
+    plain = tmp_path / "OUTCAR"
+    plain.write_bytes(CONTENT)
+    path = tmp_path / f"OUTCAR{suffix}"
+    _write(path)
+    matcher = SignatureMatcher(["line 19000\n", "line 10\n", "absent"])
+    for max_bytes in [100, 20000, None]:
+        expected = search_tail(plain, matcher, 64, max_bytes)
+        assert search_tail_compressed(path, matcher, 64, max_bytes) == expected
+
+
+def test_gzip_seek_index(tmp_path, small_chunks):
+    path = tmp_path / "OUTCAR.gz"
+    _write(path)
+    index = GzipSeekIndex(path, spacing=10000, max_points=4)
+    assert index.size == len(CONTENT)
+    assert len(index._points) <= 4
+    assert b"".join(reversed(list(index.reverse_blocks()))) == CONTENT
+    offset, _ = next(index.iter_from(len(CONTENT) - 10))
+    assert offset > 0
+
+
+def test_check_job_status_compressed(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        compressed = outcar.with_name("OUTCAR.gz")
+        compressed.write_bytes(gzip.compress(outcar.read_bytes()))
+        outcar.unlink()
+        assert check_job_status(outcar.parent, CONFIG["out"]["VASP"])
+        report = generate_report(tmpdir, "submit.sbatch")
+        assert report["VASP"]["success"] == [str(outcar.parent)]
+
+
+@pytest.mark.parametrize(
+    "suffix, damage",
+    [(".xz", "truncated"), (".gz", "corrupt"), (".gz", "no trailer")],
+)
+def test_damaged_compressed_output(tmp_path, suffix, damage):
+    (tmp_path / "feff.inp").write_text("")
+    (tmp_path / "xmu.dat").write_text("data\n")
+    data = CONTENT + b"feff ends at\n"
+    if damage == "truncated":
+        data = lzma.compress(data)
+        data = data[: len(data) // 2]
+    elif damage == "corrupt":
+        data = gzip.compress(data)
+        data = data[:20] + b"\xff" * 200 + data[220:]
+    else:
+        # All the content, but not the checksum and size which end the member
+        data = gzip.compress(data)[:-8]
+    (tmp_path / f"feff.out{suffix}").write_bytes(data)
+    checks = CONFIG["out"]["FEFF"]
+    assert not check_job_status(tmp_path, checks)
+    assert diagnose_job(tmp_path, checks, CONFIG["errors"]["FEFF"]) == (
+        False,
+        [],
+    )
+    report = generate_report(tmp_path, "feff.inp")
+    assert report["FEFF"]["fail"] == [str(tmp_path)]
@@ -0,0 +1,54 @@
+import json
+
+from ..detect import CalculationTypeDetector, load_codes
+from ..report import CONFIG, generate_report
+
+
+def test_detector():
+    detector = CalculationTypeDetector(
+        {
+            "QE": ["*.pwi"],
+            "XSPECTRA": ["*.pwi", "xspectra.in"],
+            "ORCA": ["orca.inp", "*.xyz"],
+            "FEFF": ["feff.inp"],
+        }
+    )
+    assert detector.matches(["scf.pwi", "x"]) == ["QE"]
+    assert detector.matches(["scf.pwi", "xspectra.in"]) == ["XSPECTRA"]
+    assert detector.matches(["orca.inp"]) == []
+    assert detector.matches(["orca.inp", "a.xyz", "feff.inp"]) == [
+        "ORCA",
+        "FEFF",
+    ]
+    assert CalculationTypeDetector(CONFIG["in"]).matches(
+        ["INCAR", "POSCAR", "KPOINTS", "POTCAR", "OUTCAR"]
+    ) == ["VASP"]
+
+
+def test_load_codes(DummyDirectories, tmp_path):
+    codes = {
+        "ORCA": {
+            "in": ["orca.inp"],
+            "out": [["orca.out", "ORCA TERMINATED NORMALLY"]],
+        }
+    }
+    with open(tmp_path / "codes.json", "w") as f:
+        json.dump(codes, f)
+    config = load_codes(tmp_path / "codes.json", CONFIG)
+    assert "ORCA" not in CONFIG["in"]
+    assert config["errors"]["ORCA"] == []
+
+    dummy = DummyDirectories()
+    dummy.calculations = dict(
+        dummy.calculations, orca=["submit.sbatch", "orca.inp"]
+    )
+    with dummy as tmpdir:
+        report = generate_report(
+            tmpdir,
+            "submit.sbatch",
+            input_files=config["in"],
+            output_files=config["out"],
+            errors=config["errors"],
+        )
+        assert report["ORCA"]["counts"] == {"success": 0, "fail": 1}
+        assert report["VASP"]["counts"] == {"success": 1, "fail": 0}
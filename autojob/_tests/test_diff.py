@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import pytest
+
+from ..diff import iter_saved_records, iter_transitions
+from ..file_utils import save_json
+from ..report import generate_report, iter_job_statuses
+from ..store import JsonlWriter
+
+
+def test_iter_transitions():
+    old = [
+        {"path": "a", "ctype": "VASP", "status": "fail"},
+        {"path": "b", "ctype": "VASP", "status": "success"},
+        {"path": "c", "ctype": "FEFF", "status": "fail"},
+        {"path": "d", "ctype": "FEFF", "status": "fail"},
+    ]
+    new = [
+        {"path": "a", "ctype": "VASP", "status": "success"},
+        {"path": "b", "ctype": "VASP", "status": "success"},
+        {"path": "d", "ctype": "FEFF", "status": "fail"},
+        {"path": "e", "ctype": "FEFF", "status": "fail", "reasons": ["x"]},
+    ]
+    transitions = list(iter_transitions(lambda: iter(old), new))
+    assert [(xx["path"], xx["change"]) for xx in transitions] == [
+        ("a", "finished"),
+        ("e", "failed"),
+        ("c", "disappeared"),
+    ]
+    assert transitions[1]["before"] is None
+    assert transitions[1]["reasons"] == ["x"]
+    assert transitions[2]["after"] is None
+
+
+def test_diff_saved_reports(DummyDirectories, tmp_path):
+    with DummyDirectories() as tmpdir:
+        save_json(generate_report(tmpdir, "submit.sbatch"), tmp_path / "r.json")
+        with JsonlWriter(tmp_path / "r.jsonl") as stream:
+            generate_report(tmpdir, "submit.sbatch", stream=stream)
+        records = list(iter_saved_records(tmp_path / "r.jsonl"))
+        assert len(records) == 4
+        transitions = iter_transitions(
+            lambda: iter_saved_records(tmp_path / "r.json"),
+            [xx for xx in records if xx["status"] != "unknown"],
+        )
+        assert list(transitions) == []
+
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        outcar.write_text("running\n")
+        new = iter_job_statuses(tmpdir, "submit.sbatch")
+        (transition,) = iter_transitions(
+            lambda: iter_saved_records(tmp_path / "r.jsonl"), new
+        )
+        assert transition["path"] == str(outcar.parent)
+        assert transition["change"] == "failed"
+
+        with pytest.raises(FileNotFoundError):
+            next(iter_saved_records(tmp_path / "missing.sqlite"))
+        assert not (tmp_path / "missing.sqlite").exists()
+
+
+def test_diff_relative_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old = [{"path": "runs/x", "ctype": "VASP", "status": "success"}]
+    new = [dict(old[0], path=str(tmp_path / "runs" / "x"))]
+    assert list(iter_transitions(lambda: old, new)) == []
@@ -1,12 +1,21 @@
+import errno
+import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from uuid import uuid4
 
 from ..file_utils import (
     exhaustive_directory_search,
+    iter_directory_search,
     run_command,
     read_json,
     save_json,
+    tail,
+    scan_file,
+    geometric_sizes,
+    search_reverse_blocks,
+    search_tail,
+    SignatureMatcher,
 )
 
 
@@ -19,6 +28,26 @@ def test_exhaustive_directory_search(DummyDirectories):
             assert Path(dd).parts[-1] in calc_names
 
 
+def test_directory_search_stale(DummyDirectories, monkeypatch):
+    scandir = os.scandir
+
+    def stale_scandir(path):
+        if isinstance(path, str) and os.path.basename(path) == "test1":
+            raise OSError(errno.ESTALE, "Stale file handle", path)
+        return scandir(path)
+
+    with DummyDirectories() as tmpdir:
+        expected = exhaustive_directory_search(tmpdir, "submit.sbatch")
+
+        # Directories which cannot be listed are skipped
+        with monkeypatch.context() as m:
+            m.setattr(os, "scandir", stale_scandir)
+            found = exhaustive_directory_search(tmpdir, "submit.sbatch")
+        assert sorted(found) == sorted(
+            xx for xx in expected if Path(xx).name != "test1"
+        )
+
+
 def test_run_command():
     with TemporaryDirectory() as tempdir:
         name = Path(tempdir) / Path("aintnothingbutaheartache.txt")
@@ -38,3 +67,133 @@ def test_save_read_json():
         dummy_dictionary2 = read_json(name2)
     assert dummy_dictionary == dummy_dictionary1
     assert dummy_dictionary == dummy_dictionary2
+
+
+def test_exhaustive_directory_search_serial_matches_threaded(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        spaced = Path(tmpdir) / Path("with spaces") / Path("calc")
+        spaced.mkdir(parents=True)
+        (spaced / Path("submit.sbatch")).touch()
+        threaded = exhaustive_directory_search(tmpdir, "submit.sbatch")
+        serial = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", max_workers=1
+        )
+        assert threaded == serial
+        assert spaced in threaded
+        assert len(threaded) == 5
+
+
+def test_iter_directory_search(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        expected = exhaustive_directory_search(tmpdir, "submit.sbatch")
+        found = iter_directory_search(tmpdir, "submit.sbatch", max_workers=2)
+        assert sorted(found) == expected
+
+        # Stopping early must not hang or raise
+        found = iter_directory_search(tmpdir, "submit.sbatch", max_workers=2)
+        assert next(found) in expected
+        found.close()
+
+
+def test_directory_search_depth_and_prune(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        nested = Path(tmpdir) / Path("a") / Path("b") / Path("c")
+        nested.mkdir(parents=True)
+        (nested / Path("submit.sbatch")).touch()
+        (nested.parent / Path("submit.sbatch")).touch()
+        res = exhaustive_directory_search(tmpdir, "submit.sbatch")
+        assert len(res) == 6
+
+        # The dummy calculations are all at depth 2
+        res = exhaustive_directory_search(tmpdir, "submit.sbatch", max_depth=2)
+        assert len(res) == 5
+        assert nested.parent in res
+        res = exhaustive_directory_search(tmpdir, "submit.sbatch", min_depth=3)
+        assert res == [nested]
+        res = exhaustive_directory_search(tmpdir, "submit.sbatch", prune=["b"])
+        assert len(res) == 4
+        res = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", stop_at_marker=True, max_workers=1
+        )
+        assert len(res) == 5
+        assert nested not in res
+
+
+def test_directory_search_listing(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        res = exhaustive_directory_search(
+            tmpdir, ["feff.inp", "INCAR"], with_listing=True, stat_entries=True
+        )
+        assert [dd.parts[-1] for dd, _ in res].count("test_no_submit") == 0
+        assert len(res) == 3
+        for dd, listing in res:
+            assert set(listing) == {xx.name for xx in dd.iterdir()}
+            for name, (size, _) in listing.items():
+                assert size == (dd / name).stat().st_size
+
+
+def test_tail():
+    with TemporaryDirectory() as tempdir:
+        name = Path(tempdir) / Path("file with spaces.txt")
+        with open(name, "w") as f:
+            f.write("".join(f"line{ii}\n" for ii in range(1000)))
+        for block_size in [1, 7, 65536]:
+            res = tail(name, 3, block_size=block_size)
+            assert res == b"line997\nline998\nline999\n"
+        assert tail(name, 2000) == name.read_bytes()
+        assert tail(name, None, max_bytes=8) == b"line999\n"
+        assert tail(name, 100, max_bytes=10) == b"8\nline999\n"
+
+        with open(name, "w") as f:
+            f.write("a\nb\nc")
+        assert tail(name, 2, block_size=1) == b"b\nc"
+
+
+def test_signature_matcher():
+    matcher = SignatureMatcher(["feff ends", "ends at", "feff", "missing"])
+    found = matcher.search(b"xx\nfeff ends at 12:00\n")
+    assert found == {"feff ends", "ends at", "feff"}
+    assert matcher.search(b"") == set()
+    assert SignatureMatcher(["a.c"]).search(b"abc") == set()
+    assert SignatureMatcher([]).search(b"abc") == set()
+
+
+def test_scan_file():
+    matcher = SignatureMatcher(["Iteration", "timing"])
+    with TemporaryDirectory() as tempdir:
+        name = Path(tempdir) / Path("OUTCAR")
+        with open(name, "w") as f:
+            f.write("timing\n" + "Iteration 1\n" * 1000 + "end\n")
+        assert scan_file(name, matcher) == {"Iteration", "timing"}
+        assert scan_file(name, matcher, start=-100) == {"Iteration"}
+        assert scan_file(name, matcher, start=-4) == set()
+        assert scan_file(name, matcher, 0, 6) == {"timing"}
+        assert scan_file(name, matcher, 0, 5) == set()
+        counts = scan_file(name, matcher, count=True)
+        assert counts == {"Iteration": 1000, "timing": 1}
+
+        name.write_bytes(b"")
+        assert scan_file(name, matcher) == set()
+
+
+def test_search_tail(tmp_path):
+    path = tmp_path / "feff.out"
+    with open(path, "wb") as f:
+        f.write(b"feff ends at 12:00\n" + b"warning: something\n" * 1000)
+    matcher = SignatureMatcher(["feff ends at", "warning", "absent"])
+    assert list(geometric_sizes(10, 2, 75)) == [10, 10, 20, 35]
+
+    # The block boundaries split the signature for some initial sizes
+    for initial in range(1, 40):
+        assert search_tail(path, matcher, initial, None, 2) == {
+            "feff ends at",
+            "warning",
+        }
+    assert search_tail(path, matcher, 64, 1000) == {"warning"}
+    assert search_tail(path, matcher, 64, None, required=["warning"]) == {
+        "warning"
+    }
+    matcher = SignatureMatcher(["warning"])
+    blocks = iter([b"warning", b"x"])
+    assert search_reverse_blocks(blocks, matcher) == {"warning"}
+    assert list(blocks) == [b"x"]
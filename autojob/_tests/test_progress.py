@@ -0,0 +1,90 @@
+from pathlib import Path
+
+from .. import progress as progress_module
+from ..progress import (
+    ProgressCache,
+    job_progress,
+    parse_progress,
+    parse_outcar,
+)
+from ..report import generate_report
+
+
+OSZICAR_STEP = (
+    "       N       E                     dE             d eps       ncg\n"
+    "DAV:   1    -0.1E+02   -0.1E+02   -0.1E+03   100\n"
+    "DAV:   2    -0.2E+02   -0.1E+02   -0.1E+03   100\n"
+    "   {} F= -.10000000E+02 E0= -.1E+02  d E =-.1E+02\n"
+)
+
+
+def test_parse_progress_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr(progress_module, "CHUNK_SIZE", 16)
+    path = tmp_path / "OSZICAR"
+    cache = ProgressCache(tmp_path / "progress.json")
+    path.write_text(OSZICAR_STEP.format(1) + "DAV:   1    -0.1E+0")
+    state = parse_progress(path, "oszicar", cache)
+    assert state == {"ionic_steps": 1, "scf_steps": 0, "energy": -10.0}
+
+    # Only the appended bytes are parsed, starting from the incomplete line
+    parsed = []
+
+    def recording_parser(lines, state):
+        parsed.extend(lines)
+        return progress_module.parse_oszicar(lines, state)
+
+    monkeypatch.setitem(progress_module.PARSERS, "oszicar", recording_parser)
+    with open(path, "a") as f:
+        f.write("2 -0.2E+02\nRMM:   3  -0.1E+02\n")
+    state = parse_progress(path, "oszicar", cache)
+    assert state["scf_steps"] == 3
+    assert parsed == [b"DAV:   1    -0.1E+02 -0.2E+02", b"RMM:   3  -0.1E+02"]
+
+    # A replaced file is parsed from the start
+    path.write_text(OSZICAR_STEP.format(1) * 2 + "DAV:   5\n")
+    state = parse_progress(path, "oszicar", cache)
+    assert state["scf_steps"] == 5
+
+
+def test_parse_outcar():
+    lines = [
+        b"----- Iteration      1(   1)  -----",
+        b"----- Iteration      1(   2)  -----",
+        b"----- Iteration      2(   1)  -----",
+    ]
+    assert parse_outcar(lines, {}) == {"ionic_steps": 1, "scf_steps": 1}
+
+
+def test_job_progress_unreadable(tmp_path, monkeypatch):
+    sources = [["OSZICAR", "oszicar"], ["OUTCAR", "outcar"]]
+    (tmp_path / "OSZICAR").mkdir()
+    assert job_progress(tmp_path, sources) is None
+
+    # Other files are tried instead
+    (tmp_path / "OUTCAR").write_text("----- Iteration      1(   3)  -----\n")
+    assert job_progress(tmp_path, sources)["scf_steps"] == 3
+
+    def undecodable(lines, state):
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid")
+
+    monkeypatch.setitem(progress_module.PARSERS, "outcar", undecodable)
+    assert job_progress(tmp_path, sources) is None
+
+
+def test_generate_report_progress(DummyDirectories, tmp_path):
+    with DummyDirectories() as tmpdir:
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        outcar.write_text("running\n")
+        (outcar.parent / "OSZICAR").write_text(OSZICAR_STEP.format(4))
+        cache = ProgressCache(tmp_path / "progress.json")
+        report = generate_report(tmpdir, "submit.sbatch", progress=cache)
+        assert report["VASP"]["progress"] == {
+            str(outcar.parent): {
+                "ionic_steps": 4,
+                "scf_steps": 0,
+                "energy": -10.0,
+            }
+        }
+        assert report["FEFF"]["progress"] == {}
+        cache.save()
+        assert len(ProgressCache.load(tmp_path / "progress.json")) == 1
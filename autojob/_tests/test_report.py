@@ -1,10 +1,14 @@
 from pathlib import Path
 
 
+from .. import file_utils
 from ..file_utils import exhaustive_directory_search
 from ..report import (
+    CONFIG,
     generate_report,
     check_computation_type,
+    check_job_status,
+    diagnose_job,
 )
 
 
@@ -28,3 +32,141 @@ def test_check_computation_type(DummyDirectories):
                 assert value == "FEFF"
             else:
                 assert value is None
+
+
+def test_check_job_status_from_listing(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        res = exhaustive_directory_search(
+            tmpdir, "submit.sbatch", with_listing=True, stat_entries=True
+        )
+        for dd, listing in res:
+            ctype = check_computation_type(dd, contained=listing)
+            if ctype is None:
+                continue
+            checks = CONFIG["out"][ctype]
+            assert check_job_status(dd, checks, listing=listing)
+            listing = {k: v for k, v in listing.items() if k != checks[0][0]}
+            assert not check_job_status(dd, checks, listing=listing)
+
+
+def test_generate_report_parallel(DummyDirectories):
+    dummy = DummyDirectories()
+    dummy.calculations = {
+        f"{key}-{ii}": value
+        for key, value in dummy.calculations.items()
+        for ii in range(10)
+    }
+    with dummy as tmpdir:
+        report = generate_report(tmpdir, "submit.sbatch")
+        assert generate_report(tmpdir, "submit.sbatch", jobs=4) == report
+        assert list(report) == ["FEFF", "VASP"]
+        assert len(report["VASP"]["success"]) == 10
+        assert len(report["FEFF"]["success"]) == 10
+
+
+def test_check_job_status_window(tmp_path):
+    with open(tmp_path / "OUTCAR", "w") as f:
+        f.write("timing\n" + "Iteration\n" * 200)
+    checks = [["OUTCAR", "timing", {"lines": 100}]]
+    assert not check_job_status(tmp_path, checks)
+    assert check_job_status(tmp_path, [["OUTCAR", "timing", {"bytes": None}]])
+    checks = [["OUTCAR", "timing", {"range": [0, 100]}]]
+    assert check_job_status(tmp_path, checks)
+    checks = [["OUTCAR", "timing", {"bytes": 100}]]
+    assert not check_job_status(tmp_path, checks)
+
+
+def test_diagnose_job(tmp_path):
+    checks = [["OUTCAR", "General timing"]]
+    errors = CONFIG["errors"]["VASP"]
+    with open(tmp_path / "OUTCAR", "w") as f:
+        f.write("Iteration\n" * 10)
+    with open(tmp_path / "vasp.out", "w") as f:
+        f.write("Error EDDDAV: Call to ZHEGV failed\n")
+    with open(tmp_path / "slurm-1.out", "w") as f:
+        f.write(
+            "Error EDDDAV\n"
+            "slurmstepd: error: JOB 1 CANCELLED DUE TO TIME LIMIT\n"
+        )
+    assert diagnose_job(tmp_path, checks, errors) == (
+        False,
+        ["EDDDAV", "time limit"],
+    )
+
+    # Error logs are not read for successful jobs
+    with open(tmp_path / "OUTCAR", "a") as f:
+        f.write("General timing and accounting\n")
+    assert diagnose_job(tmp_path, checks, errors) == (True, [])
+
+
+def test_generate_report_reasons(DummyDirectories):
+    with DummyDirectories() as tmpdir:
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        outcar.write_text("ZBRENT: fatal error in bracketing\n")
+        report = generate_report(tmpdir, "submit.sbatch")
+        assert report["VASP"]["fail"] == [str(outcar.parent)]
+        assert report["VASP"]["reasons"] == {str(outcar.parent): ["ZBRENT"]}
+        assert report["VASP"]["reason_counts"] == {"ZBRENT": 1}
+        assert report["FEFF"]["reasons"] == {}
+
+
+def test_generate_report_reason_counts(tmp_path):
+    outcars = {
+        "0": "ZBRENT: fatal error\nTOO FEW BANDS\n",
+        "1": "Error EDDDAV\n",
+        "2": "ZBRENT: fatal error\n",
+    }
+    for name, text in outcars.items():
+        directory = tmp_path / name
+        directory.mkdir()
+        for filename in CONFIG["in"]["VASP"] + ["submit.sbatch"]:
+            (directory / filename).touch()
+        (directory / "OUTCAR").write_text(text)
+
+    # Ties are ordered by reason, whatever order the jobs are checked in
+    for jobs in [1, 3]:
+        report = generate_report(tmp_path, "submit.sbatch", jobs=jobs)
+        assert list(report["VASP"]["reason_counts"].items()) == [
+            ("ZBRENT", 2),
+            ("EDDDAV", 1),
+            ("too few bands", 1),
+        ]
+
+
+def test_check_job_status_adaptive(tmp_path, monkeypatch):
+    with open(tmp_path / "OUTCAR", "w") as f:
+        f.write("timing\n" + "Iteration\n" * 200)
+
+    assert check_job_status(tmp_path, [["OUTCAR", "timing"]])
+    window = {"adaptive": {"initial": 64, "max_bytes": 1000, "growth": 2}}
+    assert not check_job_status(tmp_path, [["OUTCAR", "timing", window]])
+    window = {"adaptive": {"initial": 64, "max_bytes": None, "growth": 2}}
+    assert check_job_status(tmp_path, [["OUTCAR", "timing", window]])
+
+
+def test_diagnose_job_bytes_read(tmp_path, monkeypatch):
+    blocks = file_utils._reverse_sized_blocks
+    sizes = []
+
+    def counting_blocks(f, sizes_):
+        for block in blocks(f, sizes_):
+            sizes.append(len(block))
+            yield block
+
+    monkeypatch.setattr(file_utils, "_reverse_sized_blocks", counting_blocks)
+    checks = CONFIG["out"]["VASP"]
+    errors = CONFIG["errors"]["VASP"]
+    padding = " Iteration\n" * (1 << 18)
+    with open(tmp_path / "OUTCAR", "w") as f:
+        f.write("Error EDDDAV\n" + padding + checks[0][1] + "\n")
+
+    # The search stops once the job is known to have completed
+    assert diagnose_job(tmp_path, checks, errors) == (True, [])
+    assert sum(sizes) == 4096
+
+    # Otherwise, it grows to find the reasons of the failure
+    sizes.clear()
+    with open(tmp_path / "OUTCAR", "w") as f:
+        f.write("Error EDDDAV\n" + padding[: 1 << 19])
+    assert diagnose_job(tmp_path, checks, errors) == (False, ["EDDDAV"])
+    assert sum(sizes) > 4096
@@ -0,0 +1,36 @@
+import os
+
+from ..rollup import Rollup
+
+
+def _record(path, status, ctype="FEFF", **kwargs):
+    return dict(path=path, ctype=ctype, status=status, **kwargs)
+
+
+def test_rollup():
+    root = os.path.join("campaign", "")
+    rollup = Rollup(root)
+    rollup.begin()
+    for record in [
+        _record("campaign/Cu/fcc/K/0", "success"),
+        _record("campaign/Cu/fcc/K/1", "fail", reasons=["time limit"]),
+        _record("campaign/Cu/bcc/K/0", "fail", progress={"stage": "fms"}),
+        _record("campaign/Ni/fcc/K/0", "success"),
+        _record("campaign/Ni/fcc/K/1", "success"),
+        _record("campaign/other", "unknown", ctype=None),
+    ]:
+        rollup.add(record)
+    rollup.finish()
+
+    nodes = dict(rollup.iter_nodes())
+    assert nodes["."] == {"success": 3, "fail": 1, "running": 1, "unknown": 1}
+    assert nodes["Cu"] == {"success": 1, "fail": 1, "running": 1, "unknown": 0}
+    assert nodes[os.path.join("Cu", "bcc", "K")]["running"] == 1
+    assert "other" not in nodes
+    assert [xx[0] for xx in rollup.iter_nodes(depth=1)] == ["Cu", "Ni"]
+
+    (worst,) = rollup.least_complete(1, depth=2)
+    assert worst[0] == os.path.join("Cu", "bcc")
+    assert worst[1] == 0.0
+    assert [xx[0] for xx in rollup.least_complete(3, depth=1)] == ["Cu", "Ni"]
+    assert rollup.to_dict()["tree"][0] == [3, 1, 1, 1]
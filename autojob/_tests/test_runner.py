@@ -0,0 +1,102 @@
+from multiprocessing import Process
+
+from ..file_utils import read_json
+from ..runner import WorkQueue, run_calculation, run_chunk, run_worker
+from ..store import read_jsonl
+from ..tether import read_runtimes, tether_constructor
+
+
+def test_work_queue(tmp_path):
+    directories = []
+    for ii in range(20):
+        dd = tmp_path / "jobs" / str(ii)
+        dd.mkdir(parents=True)
+        directories.append(dd)
+    queue = WorkQueue.create(tmp_path / "queue", directories, "echo ran > log")
+    assert queue.remaining() == 20
+
+    # Several processes with several threads each share the queue
+    workers = [
+        Process(target=run_worker, args=(tmp_path / "queue", 3))
+        for _ in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert queue.remaining() == 0
+    assert queue.claim() is None
+    done = list(read_jsonl(tmp_path / "queue" / "done.jsonl"))
+    assert sorted(xx["path"] for xx in done) == sorted(
+        str(dd) for dd in directories
+    )
+    assert all(xx["returncode"] == 0 for xx in done)
+    assert all((dd / "log").read_text() == "ran\n" for dd in directories)
+
+
+def test_tether_queue_mode(DummyDirectories, tmp_path):
+    with DummyDirectories() as tmpdir:
+        tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "staged",
+            3,
+            ["#!/bin/bash"],
+            "echo ran > log &",
+            mode="queue",
+        )
+        queue = tmp_path / "staged" / "queue"
+        config = read_json(queue / "config.json")
+        assert config["executable"] == "echo ran > log"
+        assert WorkQueue(queue).remaining() == 4
+        scripts = sorted((tmp_path / "staged").glob("*/submit.sbatch"))
+        assert len(scripts) == 2
+        assert f"aj work {queue} --slots 3" in scripts[0].read_text()
+
+
+def test_run_calculation(tmp_path):
+    record = run_calculation(tmp_path, "exit 3")
+    assert record["path"] == str(tmp_path)
+    assert record["returncode"] == 3
+    assert record["elapsed"] >= 0
+    assert record["maxrss"] > 0
+    assert record["user"] >= 0 and record["system"] >= 0
+    assert run_calculation(tmp_path, "kill -9 $$")["returncode"] == -9
+
+    # Records have the same keys when the command cannot be started
+    failed = run_calculation(tmp_path / "missing", "true")
+    assert failed.keys() == record.keys()
+    assert failed["returncode"] is None and failed["maxrss"] is None
+
+
+def test_tether_chunk_mode(DummyDirectories, tmp_path):
+    with DummyDirectories() as tmpdir:
+        tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "staged",
+            3,
+            ["#!/bin/bash"],
+            "echo ran > log &",
+            mode="chunk",
+            slots=2,
+        )
+        chunks = sorted((tmp_path / "staged").glob("*/chunk.json"))
+        assert len(chunks) == 2
+        script = chunks[0].parent / "submit.sbatch"
+        assert f"aj run-chunk {chunks[0]} --slots 2" in script.read_text()
+
+        records = []
+        for chunk in chunks:
+            chunk_records = run_chunk(chunk, slots=2)
+            assert chunk_records == list(
+                read_jsonl(chunk.parent / "manifest.jsonl")
+            )
+            records.extend(chunk_records)
+        assert len(records) == 4
+        assert all(xx["returncode"] == 0 for xx in records)
+        runtimes = read_runtimes(
+            sorted((tmp_path / "staged").glob("*/manifest.jsonl"))
+        )
+        assert sorted(runtimes) == sorted(xx["path"] for xx in records)
@@ -0,0 +1,106 @@
+from pathlib import Path
+
+from ..report import generate_report
+from ..store import JsonlWriter, ReportStore, read_jsonl
+
+
+def test_report_store(DummyDirectories, tmp_path):
+    with DummyDirectories() as tmpdir:
+        (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+        outcar.write_text("ZBRENT: fatal error in bracketing\n")
+        with ReportStore(tmp_path / "report.sqlite", batch_size=2) as store:
+            report = generate_report(tmpdir, "submit.sbatch", store=store)
+            assert len(store) == 4
+
+            (row,) = store.query(status="fail")
+            assert row["path"] == str(outcar.parent)
+            assert row["reasons"] == ["ZBRENT"]
+            assert row["files"]["OUTCAR"][0] == outcar.stat().st_size
+            assert [xx["path"] for xx in store.query(ctype="FEFF")] == (
+                report["FEFF"]["success"]
+            )
+            assert [xx["path"] for xx in store.query(reason="ZBRENT")] == [
+                row["path"]
+            ]
+            assert len(list(store.query(under=outcar.parent.parent))) == 1
+            assert len(list(store.query(under=tmpdir))) == 4
+            assert len(list(store.query(under=str(outcar.parent)[:-1]))) == 0
+            assert store.counts(status="success") == {("FEFF", "success"): 1}
+
+        # Directories which no longer exist are removed
+        for path in outcar.parent.iterdir():
+            path.unlink()
+        outcar.parent.rmdir()
+        with ReportStore(tmp_path / "report.sqlite") as store:
+            generate_report(tmpdir, "submit.sbatch", store=store)
+            assert len(store) == 3
+            assert list(store.query(reason="ZBRENT")) == []
+
+
+def test_report_store_roots(DummyDirectories, tmp_path):
+    with DummyDirectories() as root_a, DummyDirectories() as root_b:
+        with ReportStore(tmp_path / "report.sqlite") as store:
+            generate_report(root_a, "submit.sbatch", store=store)
+            generate_report(root_b, "submit.sbatch", store=store)
+            assert len(store) == 8
+
+            # Reporting one root again leaves the rows of the other one
+            (outcar,) = Path(root_b).glob("*/*/OUTCAR")
+            for path in outcar.parent.iterdir():
+                path.unlink()
+            outcar.parent.rmdir()
+            generate_report(root_b, "submit.sbatch", store=store)
+            assert len(store) == 7
+            assert len(list(store.query(under=root_a))) == 4
+
+
+def test_report_store_relative_root(DummyDirectories, tmp_path, monkeypatch):
+    with DummyDirectories() as tmpdir:
+        monkeypatch.chdir(Path(tmpdir).parent)
+        relative = Path(tmpdir).name
+        with ReportStore(tmp_path / "report.sqlite") as store:
+            generate_report(relative, "submit.sbatch", store=store)
+            generate_report(tmpdir, "submit.sbatch", store=store)
+            assert len(store) == 4
+            assert all(Path(xx["path"]).is_absolute() for xx in store.query())
+            assert len(list(store.query(under=relative))) == 4
+
+            # Stale rows are removed whichever way the root is spelled
+            (outcar,) = Path(tmpdir).glob("*/*/OUTCAR")
+            for path in outcar.parent.iterdir():
+                path.unlink()
+            outcar.parent.rmdir()
+            generate_report(relative, "submit.sbatch", store=store)
+            assert len(store) == 3
+
+
+def test_report_store_journal(tmp_path):
+    for wal, mode in [(False, "delete"), (True, "wal")]:
+        with ReportStore(tmp_path / f"{mode}.sqlite", wal=wal) as store:
+            cursor = store._connection.execute("PRAGMA journal_mode")
+            assert cursor.fetchone()[0] == mode
+
+
+def test_jsonl_writer(DummyDirectories, tmp_path):
+    path = tmp_path / "report.jsonl"
+    with DummyDirectories() as tmpdir:
+        report = generate_report(tmpdir, "submit.sbatch")
+        with JsonlWriter(path) as stream:
+            summary = generate_report(
+                tmpdir, "submit.sbatch", stream=stream, keep_paths=False
+            )
+    assert summary == {
+        ctype: {key: value[key] for key in ["counts", "reason_counts"]}
+        for ctype, value in report.items()
+    }
+    records = list(read_jsonl(path))
+    assert len(records) == 4
+    for ctype, value in report.items():
+        assert value["success"] == sorted(
+            xx["path"] for xx in records if xx["ctype"] == ctype
+        )
+
+    # A partially written record is skipped
+    with open(path, "a") as f:
+        f.write('{"path": ')
+    assert len(list(read_jsonl(path))) == 4
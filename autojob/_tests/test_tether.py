@@ -0,0 +1,240 @@
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from .. import tether
+from ..entrypoint import entrypoint
+from ..file_utils import save_json
+from ..report import CONFIG
+from ..tether import (
+    chunks,
+    get_slot_lines,
+    get_cost_function,
+    load_imbalance,
+    lpt_pack,
+    pack,
+)
+
+
+def test_chunks():
+    assert list(chunks(list(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunks(iter(range(4)), 2)) == [[0, 1], [2, 3]]
+    assert list(chunks([], 3)) == []
+
+
+def test_lpt_pack():
+    costs = [7, 1, 1, 1, 5, 5, 2, 2]
+    bins = lpt_pack(costs, 2, capacity=4)
+    assert sorted(len(xx) for xx in bins) == [4, 4]
+    assert sorted(sum(costs[ii] for ii in xx) for xx in bins) == [12, 12]
+
+
+def test_pack(tmp_path):
+    directories = []
+    for ii, size in enumerate([10, 1000, 20, 900]):
+        dd = tmp_path / str(ii)
+        dd.mkdir()
+        (dd / "INCAR").write_bytes(b"x" * size)
+        directories.append(dd)
+
+    cost = get_cost_function("size")
+    packed, costs = pack(directories, 2, "sorted", cost)
+    assert packed == [[directories[1], directories[3]], directories[2::-2]]
+    unsorted = load_imbalance([[1000, 20], [900, 10]])
+    assert load_imbalance(costs)["idle"] < unsorted["idle"]
+
+    packed, costs = pack(directories, 2, "lpt", cost)
+    assert sorted(sum(xx) for xx in costs) == [920, 1010]
+    packed = pack(directories, 3, "order")[0]
+    assert packed == [directories[:3], directories[3:]]
+
+    # Directories which vanished are given the median cost
+    packed, costs = pack(directories + [tmp_path / "gone"], 5, "lpt", cost)
+    assert sorted(costs[0]) == [10, 20, 460, 900, 1000]
+
+    runtimes = {str(directories[0]): 3600.0, str(directories[1]): 60.0}
+    cost = get_cost_function(runtimes=runtimes)
+    assert [cost(dd) for dd in directories] == [3600.0, 60.0, 1830.0, 1830.0]
+
+
+def test_slot_lines(tmp_path):
+    directories = []
+    for ii in range(5):
+        dd = tmp_path / str(ii)
+        dd.mkdir()
+        directories.append(dd)
+    (tmp_path / "running").mkdir()
+
+    # Each calculation marks itself as running, and counts the calculations
+    # running at the same time
+    marker = '../running/"${PWD##*/}"'
+    executable = (
+        f"touch {marker}; ls ../running | wc -l > count; sleep 0.2; "
+        f"rm {marker} &"
+    )
+    lines = get_slot_lines(["#!/bin/bash"], directories, executable, 2)
+    script = tmp_path / "submit.sbatch"
+    script.write_text("\n".join(lines))
+    assert subprocess.call(["bash", str(script)]) == 0
+
+    counts = [int((dd / "count").read_text()) for dd in directories]
+    assert max(counts) == 2
+    assert list((tmp_path / "running").iterdir()) == []
+
+    with pytest.raises(ValueError):
+        tether.tether_constructor(
+            tmp_path, "submit.sbatch", tmp_path / "out", 2, [], "run", slots=0
+        )
+
+
+def test_tether_skip(DummyDirectories, tmp_path, monkeypatch):
+    with DummyDirectories() as tmpdir:
+        (feff,) = Path(tmpdir).glob("*/*feff-like")
+        (vasp,) = Path(tmpdir).glob("*/*vasp-like")
+        (vasp / "OUTCAR").write_text("running\n")
+        staged = tmp_path / "staged"
+        staged.mkdir()
+        (staged / "submit.sbatch").write_text(
+            f'#!/bin/bash\n(cd "{vasp}" && run) &\nwait\n'
+        )
+
+        def squeue(cmd):
+            return {"exitcode": 0, "stdout": str(staged), "stderr": ""}
+
+        monkeypatch.setattr(tether, "run_command", squeue)
+        assert str(vasp) in tether.get_queued_directories()
+
+        tether.tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "out",
+            10,
+            ["#!/bin/bash"],
+            "run &",
+            skip_completed=True,
+            jobs=2,
+        )
+        (script,) = (tmp_path / "out").glob("*/submit.sbatch")
+        text = script.read_text()
+        assert str(vasp) in text
+        assert str(feff) not in text
+
+        tether.tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "out2",
+            10,
+            ["#!/bin/bash"],
+            "run &",
+            skip_completed=True,
+            skip_queued=True,
+        )
+        (script,) = (tmp_path / "out2").glob("*/submit.sbatch")
+        assert str(vasp) not in script.read_text()
+
+
+def test_tether_skip_queued_chunks(DummyDirectories, tmp_path, monkeypatch):
+    with DummyDirectories() as tmpdir:
+        tether.tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "chunked",
+            10,
+            ["#!/bin/bash"],
+            "run",
+            mode="chunk",
+        )
+        (chunk,) = (tmp_path / "chunked").glob("*/chunk.json")
+
+        def squeue(cmd):
+            return {"exitcode": 0, "stdout": str(chunk.parent), "stderr": ""}
+
+        # The calculations of queued chunks are not tethered again
+        monkeypatch.setattr(tether, "run_command", squeue)
+        tether.tether_constructor(
+            tmpdir,
+            "submit.sbatch",
+            tmp_path / "out",
+            10,
+            ["#!/bin/bash"],
+            "run &",
+            skip_queued=True,
+        )
+        assert not (tmp_path / "out").exists()
+
+
+def test_tether_skip_registered_codes(tmp_path):
+    orca = tmp_path / "root" / "orca"
+    orca.mkdir(parents=True)
+    (orca / "submit.sbatch").write_text("")
+    (orca / "orca.inp").write_text("")
+    (orca / "orca.out").write_text("ORCA TERMINATED NORMALLY\n")
+    config = {
+        "in": dict(CONFIG["in"], ORCA=["orca.inp"]),
+        "out": dict(
+            CONFIG["out"], ORCA=[["orca.out", "ORCA TERMINATED NORMALLY"]]
+        ),
+    }
+    for name, codes in [("default", CONFIG), ("codes", config)]:
+        tether.tether_constructor(
+            tmp_path / "root",
+            "submit.sbatch",
+            tmp_path / name,
+            10,
+            ["#!/bin/bash"],
+            "run &",
+            skip_completed=True,
+            input_files=codes["in"],
+            output_files=codes["out"],
+        )
+
+    # Unknown calculations are tethered, completed ones of the codes are not
+    assert len(list((tmp_path / "default").glob("*/submit.sbatch"))) == 1
+    assert not (tmp_path / "codes").exists()
+
+
+def test_tether_entrypoint(tmp_path, monkeypatch):
+    orca = tmp_path / "root" / "orca"
+    orca.mkdir(parents=True)
+    (orca / "submit.sbatch").write_text("")
+    (orca / "orca.inp").write_text("")
+    (orca / "orca.out").write_text("running\n")
+    autojob_root = tmp_path / "autojob"
+    (autojob_root / "tether").mkdir(parents=True)
+    save_json(
+        {
+            "ORCA": {
+                "in": ["orca.inp"],
+                "out": [["orca.out", "ORCA TERMINATED NORMALLY"]],
+            }
+        },
+        autojob_root / "codes.json",
+    )
+    config = {
+        "filename": "submit.sbatch",
+        "calculations_per_staged_job": 2,
+        "slurm_header_lines": ["#!/bin/bash"],
+        "executable": "run &",
+    }
+    for name in ["staged", "staged2"]:
+        save_json(
+            dict(config, staging_directory=name),
+            autojob_root / "tether" / f"{name}.json",
+        )
+    monkeypatch.chdir(tmp_path)
+
+    def tether_command(name):
+        entrypoint(
+            ["--autojob-root", str(autojob_root), "tether"]
+            + [str(tmp_path / "root"), "--config", name, "--skip-completed"]
+        )
+
+    tether_command("staged")
+    (script,) = (tmp_path / "staged").glob("*/submit.sbatch")
+    assert str(orca) in script.read_text()
+
+    # Completed calculations of the registered codes are not tethered again
+    (orca / "orca.out").write_text("ORCA TERMINATED NORMALLY\n")
+    tether_command("staged2")
+    assert not (tmp_path / "staged2").exists()
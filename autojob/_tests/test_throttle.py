@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from ..throttle import MetadataThrottle
+
+
+def test_rate_limit():
+    throttle = MetadataThrottle(max_ops_per_second=100, adaptive=False)
+    t0 = monotonic()
+    for _ in range(150):
+        with throttle.op():
+            pass
+    # The first 100 are a burst, the remaining 50 need half a second
+    assert monotonic() - t0 > 0.4
+    assert throttle.n_ops == 150
+
+
+def test_rate_limit_below_one():
+    throttle = MetadataThrottle(max_ops_per_second=0.8, adaptive=False)
+    thread = Thread(
+        target=lambda: [throttle._take_token() for _ in range(2)], daemon=True
+    )
+    t0 = monotonic()
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+    # The first token is available at once, the second after 1.25 seconds
+    assert 1.0 < monotonic() - t0 < 3.0
+
+
+def test_adaptive_concurrency():
+    throttle = MetadataThrottle(max_concurrency=8)
+    lock = Lock()
+    state = {"in_flight": 0, "max": 0}
+
+    def op(_):
+        with throttle.op():
+            with lock:
+                state["in_flight"] += 1
+                state["max"] = max(state["max"], state["in_flight"])
+            sleep(0.001)
+            with lock:
+                state["in_flight"] -= 1
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(op, range(400)))
+    assert state["max"] <= 8
+    assert throttle.concurrency > 1
+
+
+def test_reads():
+    throttle = MetadataThrottle(max_concurrency=8)
+    lock = Lock()
+    state = {"in_flight": 0, "max": 0}
+
+    def read(_):
+        with throttle.read():
+            with lock:
+                state["in_flight"] += 1
+                state["max"] = max(state["max"], state["in_flight"])
+            sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+
+    # Long reads neither wait for a concurrency slot nor slow down the
+    # metadata operations
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(read, range(8)))
+    assert state["max"] == 4
+    assert throttle.n_ops == 8
+    assert throttle.concurrency == 1
+    with throttle.op():
+        pass
+    assert throttle._baseline < 0.01
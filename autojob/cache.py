@@ -0,0 +1,307 @@
+"""Persistent caches which allow repeated invocations of autojob on the same
+directory tree to avoid redoing work. All caches are plain json files, usually
+stored under ``~/.autojob``, and are safe to delete at any time."""
+
+from hashlib import sha1
+import os
+from pathlib import Path
+from time import time
+
+from autojob import logger
+from autojob.file_utils import save_json, read_json
+from autojob.throttle import NULL_THROTTLE
+
+
+# Modification times this close to the start of a scan cannot be trusted, since
+# the directory could be modified again within the same timestamp tick after it
+# was listed
+MTIME_GRANULARITY_NS = 2_000_000_000
+
+
+def time_ns():
+    """Current time in integer nanoseconds (:func:`time.time_ns` is not
+    available in Python 3.6)."""
+
+    return int(time() * 1e9)
+
+
+def cache_path(cache_root, root, *keys):
+    """Gets a unique json file path for caching results pertaining to a
+    directory tree.
+
+    Parameters
+    ----------
+    cache_root : os.PathLike
+        The directory in which the cache files are stored.
+    root : os.PathLike
+        The root of the directory tree the cache pertains to.
+    *keys
+        Any other values that the cached results depend on, such as the marker
+        file name.
+
+    Returns
+    -------
+    Path
+    """
+
+    key = "\0".join([str(Path(root).resolve())] + [str(xx) for xx in keys])
+    return Path(cache_root) / Path(f"{sha1(key.encode()).hexdigest()}.json")
+
+
+class JsonCache:
+    """Base class for caches keyed by path which are saved as a single json
+    file. Entries read during a run are carried over to the next save, while
+    entries which were not accessed (e.g. directories that no longer exist)
+    are dropped.
+
+    Parameters
+    ----------
+    path : os.PathLike, optional
+        The file the cache is saved to by default.
+    entries : dict, optional
+    **metadata
+        Any other json-serializable values saved alongside the entries.
+    """
+
+    VERSION = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, path=None, entries=None, **metadata):
+        self._path = path
+        self._entries = entries if entries is not None else dict()
+        self._new_entries = None
+        self._metadata = metadata
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def load(cls, path):
+        """Loads the cache from disk. If the file does not exist or cannot be
+        read, an empty cache is returned.
+
+        Parameters
+        ----------
+        path : os.PathLike
+
+        Returns
+        -------
+        JsonCache
+        """
+
+        path = Path(path)
+        if not path.exists():
+            return cls(path)
+        try:
+            d = read_json(path)
+        except ValueError as err:
+            logger.warning(f"Ignoring unreadable cache {path}: {err}")
+            return cls(path)
+        if d.pop("version", None) != cls.VERSION:
+            logger.warning(f"Ignoring cache {path} with unknown version")
+            return cls(path)
+        return cls(path, **d)
+
+    def save(self, path=None):
+        """Saves the cache to disk as a json file. Only entries accessed since
+        the last call to :meth:`begin` are kept.
+
+        Parameters
+        ----------
+        path : os.PathLike, optional
+            Defaults to the path the cache was loaded from.
+        """
+
+        path = Path(path if path is not None else self._path)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        if self._new_entries is not None:
+            self._entries = self._new_entries
+            self._new_entries = None
+        d = {"version": self.VERSION, "entries": self._entries}
+        d.update(self._metadata)
+        save_json(d, path, indent=None)
+
+    def begin(self):
+        """Marks the start of a new run. Lookups are served from the results
+        of the previous run, and only entries accessed from now on are
+        retained when the cache is saved."""
+
+        if self._new_entries is not None:
+            self._entries = self._new_entries
+        self._new_entries = dict()
+
+    def _get(self, key):
+        value = self._entries.get(key)
+        if value is not None and self._new_entries is not None:
+            self._new_entries[key] = value
+        return value
+
+    def _set(self, key, value):
+        entries = self._new_entries
+        if entries is None:
+            entries = self._entries
+        entries[key] = value
+
+
+class DirectoryIndex(JsonCache):
+    """An on-disk record of a directory search. For every directory visited,
+    the index stores its modification time, the names of its subdirectories
+    and, if it contained a marker file, the names of its files. Adding or
+    removing entries in a directory updates its modification time, so as long
+    as the modification time is unchanged, the cached listing can be used
+    instead of reading the directory again."""
+
+    VERSION = 2
+
+    def __init__(self, path=None, entries=None, scanned_at=0):
+        super().__init__(path, entries, scanned_at=scanned_at)
+        self._trusted_before = scanned_at - MTIME_GRANULARITY_NS
+
+    def begin(self):
+        super().begin()
+        scanned_at = self._metadata["scanned_at"]
+        self._trusted_before = scanned_at - MTIME_GRANULARITY_NS
+        self._metadata["scanned_at"] = time_ns()
+
+    def lookup(self, path, mtime_ns):
+        """Gets the cached result for a directory.
+
+        Parameters
+        ----------
+        path : str
+        mtime_ns : int
+            The current modification time of the directory.
+
+        Returns
+        -------
+        tuple or None
+            The same as :func:`autojob.file_utils._scan_directory` (without
+            file statistics), or None if the directory must be listed again.
+        """
+
+        cached = self._entries.get(path)
+        if cached is None or cached[0] != mtime_ns:
+            return None
+        if mtime_ns > self._trusted_before:
+            return None
+        self._get(path)
+        listing = None
+        if cached[1] is not None:
+            listing = {name: None for name in cached[1]}
+        return listing, [os.path.join(path, xx) for xx in cached[2]]
+
+    def update(self, path, mtime_ns, listing, subdirectories):
+        """Records the result of listing a directory.
+
+        Parameters
+        ----------
+        path : str
+        mtime_ns : int
+        listing : dict or None
+            The files in the directory, if it contained a marker file.
+        subdirectories : list of str
+        """
+
+        names = [os.path.basename(xx) for xx in subdirectories]
+        files = sorted(listing) if listing is not None else None
+        self._set(path, [mtime_ns, files, names])
+
+
+class StatusCache(JsonCache):
+    """An on-disk record of the status of every directory checked by
+    :func:`autojob.report.diagnose_job`. Each verdict (and the failure
+    reasons found) is stored along with the (size, modification time, inode)
+    of the output files it was derived from. As long as none of those files
+    changed, the verdict can be reused without reading them again, which
+    costs one ``stat`` per output file instead of a read."""
+
+    VERSION = 2
+
+    def lookup(self, path, ctype, config, signature):
+        """Gets the cached status of a directory.
+
+        Parameters
+        ----------
+        path : str
+        ctype : str
+        config : list
+            The checks and error signatures used to determine the status.
+        signature : dict
+            The current :func:`file_signature` of the files checked.
+
+        Returns
+        -------
+        dict or None
+            The cached result, containing at least the "status", or None if
+            the files (or the checks) changed since it was determined.
+        """
+
+        cached = self._entries.get(path)
+        if cached is None:
+            return None
+        if cached["ctype"] != ctype or cached["config"] != config:
+            return None
+        if cached["files"] != signature:
+            return None
+        self._get(path)
+        return cached["result"]
+
+    def update(self, path, ctype, config, signature, result):
+        """Records the status of a directory. Verdicts derived from files
+        which were modified too recently are not recorded, since the files
+        could change again without their modification time changing.
+
+        Parameters
+        ----------
+        path : str
+        ctype : str
+        config : list
+        signature : dict
+        result : dict
+            Must be json-serializable.
+        """
+
+        trusted_before = time_ns() - MTIME_GRANULARITY_NS
+        for value in signature.values():
+            if value is not None and value[1] > trusted_before:
+                return
+        self._set(
+            path,
+            {
+                "ctype": ctype,
+                "config": config,
+                "result": result,
+                "files": signature,
+            },
+        )
+
+
+def file_signature(directory, filenames, throttle=NULL_THROTTLE):
+    """Gets the (size, modification time, inode) of files in a directory.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+    filenames : iterable of str
+    throttle : autojob.throttle.MetadataThrottle, optional
+
+    Returns
+    -------
+    dict
+        The filenames as keys and lists of the three values (None if the file
+        does not exist) as values.
+    """
+
+    signature = dict()
+    for filename in filenames:
+        try:
+            with throttle.op():
+                st = os.stat(os.path.join(directory, filename))
+        except OSError:
+            signature[filename] = None
+            continue
+        signature[filename] = [st.st_size, st.st_mtime_ns, st.st_ino]
+    return signature
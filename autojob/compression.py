@@ -0,0 +1,439 @@
+"""Transparent reading of compressed output files. Finished calculations are
+often archived as e.g. ``OUTCAR.gz`` or ``feff.out.xz``. The functions in this
+module mirror :func:`autojob.file_utils.tail` and
+:func:`autojob.file_utils.scan_file` for such files, decompressing them as a
+stream so that memory use stays bounded.
+
+Compressed streams cannot be read backwards, so finding the end of a file
+normally means decompressing all of it. For gzip files, a
+:class:`GzipSeekIndex` of decompressor checkpoints is built the first time a
+file is read and kept in memory, so that later reads of the same file (e.g.
+several checks on it) resume from the checkpoint closest to the data they
+need instead of from the start of the file."""
+
+import bisect
+import bz2
+from collections import Counter, OrderedDict, deque
+import gzip
+import lzma
+import os
+from threading import Lock
+import zlib
+
+from autojob.file_utils import (
+    geometric_sizes,
+    search_reverse_blocks,
+    tail_from_blocks,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_SUFFIXES = (".gz", ".xz", ".bz2", ".zst")
+
+# Amount of compressed data fed to a decompressor at a time
+CHUNK_SIZE = 1 << 18
+
+# The zlib window bits for decoding gzip (rather than raw deflate) streams
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Exceptions other than OSError raised when reading damaged (e.g. truncated or
+# corrupt) compressed files
+DECOMPRESSION_ERRORS = (EOFError, zlib.error, lzma.LZMAError)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+def is_compressed(path):
+    """Whether the file name has one of the supported compression suffixes.
+
+    Parameters
+    ----------
+    path : os.PathLike
+
+    Returns
+    -------
+    bool
+    """
+
+    return os.path.splitext(os.fspath(path))[1] in COMPRESSION_SUFFIXES
+
+
+def open_decompressed(path):
+    """Opens a compressed file for reading its decompressed content.
+
+    Parameters
+    ----------
+    path : os.PathLike
+
+    Returns
+    -------
+    file object
+        A binary file object.
+
+    Raises
+    ------
+    OSError
+        If the file is zstandard compressed, but the optional ``zstandard``
+        package is not installed.
+    """
+
+    suffix = os.path.splitext(os.fspath(path))[1]
+    if suffix == ".gz":
+        return gzip.open(path, "rb")
+    if suffix == ".xz":
+        return lzma.open(path, "rb")
+    if suffix == ".bz2":
+        return bz2.open(path, "rb")
+    if suffix == ".zst":
+        if zstandard is None:
+            raise OSError(f"The zstandard package is required to read {path}")
+        return zstandard.open(path, "rb")
+    raise ValueError(f"Unknown compression suffix {suffix}")
+
+
+def _iter_decompressed(path):
+    """Decompresses a file as a stream of chunks."""
+
+    with open_decompressed(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _inflate(f, decompressor):
+    """Decompresses a gzip file from its current position, handling files
+    made of multiple concatenated gzip members.
+
+    Parameters
+    ----------
+    f : file object
+        The compressed file, opened in binary mode.
+    decompressor : zlib.Decompress
+        A decompressor in the state corresponding to the position of ``f``.
+
+    Yields
+    ------
+    tuple
+        The decompressed data of each chunk read from ``f``, and the
+        decompressor state after it. At every yield, all data read from ``f``
+        so far has been consumed by the decompressor, so that ``f.tell()``
+        and a copy of the decompressor form a valid checkpoint.
+
+    Raises
+    ------
+    EOFError
+        If the file ends within a member (e.g. it was truncated), like
+        :func:`gzip.open`.
+    """
+
+    started = False
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            if started:
+                raise EOFError(
+                    "Compressed file ended before the end-of-stream marker"
+                )
+            return
+        data = []
+        while chunk:
+            # Trailing zero padding after the last member is allowed
+            if not started and not chunk.strip(b"\0"):
+                break
+            started = True
+            data.append(decompressor.decompress(chunk))
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            started = False
+        yield b"".join(data), decompressor
+
+
+class GzipSeekIndex:
+    """Random access into the decompressed content of a gzip file. The file
+    is decompressed once, and the complete decompressor state is saved at
+    regular intervals of decompressed output. Any later read can then start
+    from the closest preceding checkpoint.
+
+    Each checkpoint holds a copy of the decompressor and its 32 KiB window,
+    so the number of checkpoints is capped: when the cap is exceeded, every
+    other checkpoint is dropped and the spacing doubled.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    spacing : int, optional
+        The initial number of decompressed bytes between checkpoints.
+    max_points : int, optional
+        The maximum number of checkpoints.
+    """
+
+    @property
+    def size(self):
+        """The size of the decompressed content."""
+
+        return self._size
+
+    def __init__(self, path, spacing=4 << 20, max_points=64):
+        self._path = path
+        self._points = []
+        self._size = 0
+        self._build(spacing, max_points)
+
+    def _build(self, spacing, max_points):
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        points = [(0, 0, decompressor.copy())]
+        size = 0
+        with open(self._path, "rb") as f:
+            for data, decompressor in _inflate(f, decompressor):
+                size += len(data)
+                if size - points[-1][1] < spacing:
+                    continue
+                points.append((f.tell(), size, decompressor.copy()))
+                if len(points) > max_points:
+                    points = points[::2]
+                    spacing *= 2
+        self._points = points
+        self._offsets = [point[1] for point in points]
+        self._size = size
+
+    def iter_from(self, offset=0):
+        """Decompresses the file starting at the checkpoint closest to (at or
+        before) an offset.
+
+        Parameters
+        ----------
+        offset : int, optional
+            The offset into the decompressed content.
+
+        Yields
+        ------
+        tuple
+            The offset of each chunk in the decompressed content, and the
+            chunk.
+        """
+
+        ii = bisect.bisect_right(self._offsets, offset) - 1
+        position, out, decompressor = self._points[max(ii, 0)]
+        with open(self._path, "rb") as f:
+            f.seek(position)
+            for data, decompressor in _inflate(f, decompressor.copy()):
+                yield out, data
+                out += len(data)
+
+    def _segment(self, ii):
+        """Decompresses the content between two consecutive checkpoints."""
+
+        start = self._offsets[ii]
+        if ii + 1 < len(self._offsets):
+            end = self._offsets[ii + 1]
+        else:
+            end = self._size
+        parts = []
+        for out, data in self.iter_from(start):
+            parts.append(data)
+            if out + len(data) >= end:
+                break
+        return b"".join(parts)[: end - start]
+
+    def reverse_blocks(self):
+        """Decompresses the file backwards, one checkpoint interval at a time.
+
+        Yields
+        ------
+        bytes
+            Consecutive blocks of the content, starting with the last one.
+        """
+
+        for ii in reversed(range(len(self._points))):
+            yield self._segment(ii)
+
+
+_GZIP_INDEXES = OrderedDict()
+_GZIP_INDEXES_LOCK = Lock()
+_GZIP_INDEXES_MAX = 8
+
+
+def gzip_seek_index(path):
+    """Gets the :class:`GzipSeekIndex` of a file, building it if it is not
+    already held in memory. Indexes are invalidated when the file changes.
+
+    Parameters
+    ----------
+    path : os.PathLike
+
+    Returns
+    -------
+    GzipSeekIndex
+    """
+
+    st = os.stat(path)
+    key = (os.fspath(path), st.st_size, st.st_mtime_ns, st.st_ino)
+    with _GZIP_INDEXES_LOCK:
+        index = _GZIP_INDEXES.get(key)
+        if index is not None:
+            _GZIP_INDEXES.move_to_end(key)
+            return index
+
+    # Built without the lock, as this can take a while
+    index = GzipSeekIndex(path)
+    with _GZIP_INDEXES_LOCK:
+        _GZIP_INDEXES[key] = index
+        while len(_GZIP_INDEXES) > _GZIP_INDEXES_MAX:
+            _GZIP_INDEXES.popitem(last=False)
+    return index
+
+
+def tail_compressed(path, n_lines=100, max_bytes=None):
+    """Reads the end of the decompressed content of a file. Equivalent to
+    :func:`autojob.file_utils.tail` for compressed files.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    n_lines : int, optional
+    max_bytes : int, optional
+
+    Returns
+    -------
+    bytes
+    """
+
+    if os.fspath(path).endswith(".gz"):
+        blocks = gzip_seek_index(path).reverse_blocks()
+        return tail_from_blocks(blocks, n_lines, max_bytes)
+
+    # Otherwise, stream through the whole file, only keeping as many of the
+    # last chunks as are needed
+    kept = deque()
+    n_bytes = 0
+    n_newlines = 0
+    for chunk in _iter_decompressed(path):
+        kept.append(chunk)
+        n_bytes += len(chunk)
+        n_newlines += chunk.count(b"\n")
+        while len(kept) > 1:
+            first = kept[0]
+            rest_bytes = n_bytes - len(first)
+            rest_newlines = n_newlines - first.count(b"\n")
+            enough_bytes = max_bytes is not None and rest_bytes >= max_bytes
+            enough_lines = n_lines is not None and rest_newlines > n_lines
+            if not (enough_bytes or enough_lines):
+                break
+            kept.popleft()
+            n_bytes = rest_bytes
+            n_newlines = rest_newlines
+    return tail_from_blocks(reversed(kept), n_lines, max_bytes)
+
+
+def search_tail_compressed(
+    path, matcher, initial=4096, max_bytes=1 << 20, growth=4, required=None
+):
+    """Searches the end of the decompressed content of a file for signatures.
+    Equivalent to :func:`autojob.file_utils.search_tail` for compressed files.
+    The trailing ``max_bytes`` are decompressed at once, but are still
+    searched in geometrically growing blocks from the end.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    matcher : autojob.file_utils.SignatureMatcher
+    initial, max_bytes, growth, required : optional
+        See :func:`autojob.file_utils.search_tail`.
+
+    Returns
+    -------
+    set of str
+    """
+
+    if max_bytes is None:
+        data = b"".join(_iter_decompressed(path))
+    else:
+        data = tail_compressed(path, n_lines=None, max_bytes=max_bytes)
+
+    def blocks():
+        end = len(data)
+        for size in geometric_sizes(initial, growth, len(data)):
+            yield data[end - size : end]
+            end -= size
+
+    return search_reverse_blocks(blocks(), matcher, required)
+
+
+def _decompressed_size(path):
+    if os.fspath(path).endswith(".gz"):
+        return gzip_seek_index(path).size
+    return sum(len(chunk) for chunk in _iter_decompressed(path))
+
+
+def scan_compressed(path, matcher, start=None, end=None, count=False):
+    """Searches a byte range of the decompressed content of a file for
+    signatures. Equivalent to :func:`autojob.file_utils.scan_file` for
+    compressed files. The content is scanned chunk by chunk, with enough
+    overlap between chunks that no signature is missed.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    matcher : autojob.file_utils.SignatureMatcher
+    start, end : int, optional
+        The byte range of the decompressed content to scan. Negative values
+        are relative to its end, which for other than gzip files requires an
+        extra pass over the file to determine its size.
+    count : bool, optional
+
+    Returns
+    -------
+    set of str or collections.Counter
+    """
+
+    if (start is not None and start < 0) or (end is not None and end < 0):
+        size = _decompressed_size(path)
+        start, end, _ = slice(start, end).indices(size)
+    start = start or 0
+
+    if os.fspath(path).endswith(".gz"):
+        chunks = gzip_seek_index(path).iter_from(start)
+    else:
+        chunks = _with_offsets(_iter_decompressed(path))
+
+    found = Counter({xx: 0 for xx in matcher.signatures}) if count else set()
+    overlap = max(matcher.max_length - 1, 0)
+    carry = b""
+    for offset, data in chunks:
+        if end is not None and offset >= end:
+            break
+        buffer = carry + data
+        buffer_offset = offset - len(carry)
+        lo = max(0, start - buffer_offset)
+        hi = len(buffer)
+        if end is not None:
+            hi = min(hi, end - buffer_offset)
+        for position, signatures in matcher.iter_matches(buffer, lo, hi):
+            for signature in signatures:
+                # Signatures entirely within the carried over part have
+                # already been seen in the previous chunk
+                if position + matcher.length(signature) <= len(carry):
+                    continue
+                if count:
+                    found[signature] += 1
+                else:
+                    found.add(signature)
+            if not count and len(found) == len(matcher):
+                return found
+        carry = buffer[max(0, len(buffer) - overlap) :]
+    return found
+
+
+def _with_offsets(chunks):
+    offset = 0
+    for chunk in chunks:
+        yield offset, chunk
+        offset += len(chunk)
@@ -0,0 +1,167 @@
+"""Identification of the type of calculation in a directory from the names of
+its input files. Every file name (or glob pattern) required by any of the
+registered codes is assigned a bit, and each code is represented by the mask
+of the bits of its required files. A directory is then classified by building
+the mask of the relevant files it contains, and comparing it to the mask of
+each code.
+
+Codes other than the defaults in ``autojob.report.CONFIG`` can be registered
+in ``~/.autojob/codes.json``, see :func:`load_codes`."""
+
+from fnmatch import translate
+from functools import lru_cache
+import json
+import re
+
+from autojob.file_utils import read_json
+
+
+class CalculationTypeDetector:
+    """Precompiled detection rules.
+
+    Parameters
+    ----------
+    input_files : dict
+        The names of the files which must all be present in a directory for
+        it to be of each type of calculation, keyed by the type. Names may
+        be glob patterns (e.g. ``"*.pwi"``).
+    """
+
+    @property
+    def ctypes(self):
+        return list(self._masks)
+
+    def __init__(self, input_files):
+        bits = dict()
+        patterns = dict()
+        self._masks = dict()
+        for ctype, names in input_files.items():
+            mask = 0
+            for name in names:
+                table = patterns if re.search(r"[*?[]", name) else bits
+                if name not in table:
+                    table[name] = 1 << (len(bits) + len(patterns))
+                mask |= table[name]
+            self._masks[ctype] = mask
+        self._bits = bits
+        self._patterns = [
+            (re.compile(translate(pattern)).match, bit)
+            for pattern, bit in patterns.items()
+        ]
+
+    def mask(self, names):
+        """Gets the mask of the relevant files among file names.
+
+        Parameters
+        ----------
+        names : iterable of str
+
+        Returns
+        -------
+        int
+        """
+
+        mask = 0
+        for name in names:
+            bit = self._bits.get(name)
+            if bit is not None:
+                mask |= bit
+            for match, bit in self._patterns:
+                if match(name) is not None:
+                    mask |= bit
+        return mask
+
+    def matches(self, names):
+        """Gets the types of calculation whose required files are all among
+        file names. If the required files of one type are a subset of those of
+        another type which matches as well, only the latter (more specific)
+        type is kept.
+
+        Parameters
+        ----------
+        names : iterable of str
+
+        Returns
+        -------
+        list of str
+        """
+
+        mask = self.mask(names)
+        matched = {
+            ctype: required
+            for ctype, required in self._masks.items()
+            if mask & required == required
+        }
+        return [
+            ctype
+            for ctype, required in matched.items()
+            if not any(
+                other != required and other & required == required
+                for other in matched.values()
+            )
+        ]
+
+
+@lru_cache(maxsize=16)
+def _compile(key):
+    return CalculationTypeDetector(json.loads(key))
+
+
+def get_detector(input_files):
+    """Gets the detector for detection rules, compiling it only once.
+
+    Parameters
+    ----------
+    input_files : dict or CalculationTypeDetector
+
+    Returns
+    -------
+    CalculationTypeDetector
+    """
+
+    if isinstance(input_files, CalculationTypeDetector):
+        return input_files
+    return _compile(json.dumps(input_files, sort_keys=True))
+
+
+def load_codes(path, config):
+    """Registers the codes defined in a json file, e.g.::
+
+        {
+            "ORCA": {
+                "in": ["orca.inp"],
+                "out": [["orca.out", "ORCA TERMINATED NORMALLY"]],
+                "errors": [["orca.out", "SCF NOT CONVERGED", "SCF"]]
+            }
+        }
+
+    The "in" and "out" entries have the same format as the values of
+    ``CONFIG["in"]`` and ``CONFIG["out"]`` in :mod:`autojob.report`, and the
+    optional "errors" entry the same format as those of ``CONFIG["errors"]``.
+    Codes with the same names as the default ones replace them.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    config : dict
+        The default configuration, which is not modified.
+
+    Returns
+    -------
+    dict
+        The configuration, with the "in", "out" and "errors" keys.
+
+    Raises
+    ------
+    ValueError
+        If a code does not define its "in" or "out" files.
+    """
+
+    config = {key: dict(config[key]) for key in ["in", "out", "errors"]}
+    for ctype, code in read_json(path).items():
+        if "in" not in code or "out" not in code:
+            raise ValueError(f"{ctype} in {path} must define 'in' and 'out'")
+        config["in"][ctype] = code["in"]
+        config["out"][ctype] = code["out"]
+        config["errors"][ctype] = code.get("errors", [])
+    return config
@@ -0,0 +1,198 @@
+"""Differences between successive reports. When reports are generated
+regularly, usually only a few jobs change status between two of them. The
+functions in this module compare two sets of results and yield only the
+transitions: jobs which newly finished or failed, and directories which
+appeared or disappeared.
+
+The earlier results are held in memory as a mapping of fixed size path hashes
+to statuses rather than as the paths themselves, and the paths of the
+directories which disappeared are recovered with a second pass over them."""
+
+from collections import Counter
+from hashlib import blake2b
+import json
+import os
+from pathlib import Path
+
+from autojob import logger
+from autojob.store import ReportStore, read_jsonl
+
+
+def _digest(path):
+    # Paths are compared as absolute paths, as roots may be spelled
+    # differently between the results (e.g. a report store holds absolute
+    # paths)
+    return blake2b(os.path.abspath(path).encode(), digest_size=8).digest()
+
+
+def iter_saved_records(path):
+    """Lazily reads the records of saved results, which can be a report
+    (``report.json``), a report stream (see :class:`autojob.store.JsonlWriter`),
+    a report store (see :class:`autojob.store.ReportStore`) or a status cache
+    (see :class:`autojob.cache.StatusCache`).
+
+    Parameters
+    ----------
+    path : os.PathLike
+
+    Yields
+    ------
+    dict
+        Records with at least the keys "path", "ctype" and "status".
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file does not exist.
+    ValueError
+        If the report does not contain the paths of the directories.
+    """
+
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        yield from read_jsonl(path)
+        return
+    if path.suffix in (".sqlite", ".db"):
+        # Opening the store would create an empty one
+        if not path.exists():
+            raise FileNotFoundError(f"Report store {path} does not exist")
+        with ReportStore(path) as store:
+            yield from store.query()
+        return
+
+    with open(path) as f:
+        d = json.load(f)
+
+    # Status cache
+    if "version" in d and "entries" in d:
+        for key, entry in d["entries"].items():
+            yield dict(path=key, ctype=entry["ctype"], **entry["result"])
+        return
+
+    for ctype, value in d.items():
+        if "success" not in value:
+            raise ValueError(f"{path} does not contain the paths of {ctype}")
+        reasons = value.get("reasons", dict())
+        for status in ["success", "fail"]:
+            for key in value[status]:
+                yield {
+                    "path": key,
+                    "ctype": ctype,
+                    "status": status,
+                    "reasons": reasons.get(key, []),
+                }
+
+
+def classify_transition(before, after):
+    """Names the change of status of a directory.
+
+    Parameters
+    ----------
+    before, after : str or None
+        The statuses, None if the directory was not in the results.
+
+    Returns
+    -------
+    str
+        One of "disappeared", "finished", "failed", "appeared" or "changed".
+    """
+
+    if after is None:
+        return "disappeared"
+    if after == "success":
+        return "finished"
+    if after == "fail":
+        return "failed"
+    if before is None:
+        return "appeared"
+    return "changed"
+
+
+def iter_transitions(old, new):
+    """Compares two sets of results.
+
+    Parameters
+    ----------
+    old : callable
+        Returns an iterable of the earlier records, e.g.
+        ``lambda: iter_saved_records(path)``. It is called a second time if
+        any directories disappeared.
+    new : iterable of dict
+        The current records, e.g. those yielded by
+        :func:`autojob.report.iter_job_statuses`.
+
+    Yields
+    ------
+    dict
+        The transitions, with the keys "path", "ctype", "before", "after" and
+        "change" (see :func:`classify_transition`), and the "reasons" of
+        failures. Directories whose status did not change are skipped.
+    """
+
+    statuses = {xx: xx for xx in ["success", "fail", "unknown"]}
+    previous = dict()
+    for record in old():
+        status = statuses.setdefault(record["status"], record["status"])
+        previous[_digest(record["path"])] = status
+
+    for record in new:
+        before = previous.pop(_digest(record["path"]), None)
+        after = record["status"]
+        if before == after:
+            continue
+        transition = {
+            "path": record["path"],
+            "ctype": record["ctype"],
+            "before": before,
+            "after": after,
+            "change": classify_transition(before, after),
+        }
+        if after == "fail":
+            transition["reasons"] = record.get("reasons", [])
+        yield transition
+
+    if not previous:
+        return
+    for record in old():
+        if previous.pop(_digest(record["path"]), None) is None:
+            continue
+        yield {
+            "path": record["path"],
+            "ctype": record["ctype"],
+            "before": record["status"],
+            "after": None,
+            "change": "disappeared",
+        }
+
+
+def write_transitions(transitions, path=None):
+    """Writes transitions as json lines, and logs how many there were of each
+    kind.
+
+    Parameters
+    ----------
+    transitions : iterable of dict
+        As yielded by :func:`iter_transitions`.
+    path : os.PathLike, optional
+        The file written. If None, the transitions are printed.
+
+    Returns
+    -------
+    collections.Counter
+        The number of transitions of each kind.
+    """
+
+    counts = Counter()
+    f = open(path, "w") if path is not None else None
+    try:
+        for transition in transitions:
+            counts[transition["change"]] += 1
+            print(json.dumps(transition), file=f)
+    finally:
+        if f is not None:
+            f.close()
+    for change, count in sorted(counts.items()):
+        logger.info(f"{change}: {count}")
+    if not counts:
+        logger.info("No changes")
+    return counts
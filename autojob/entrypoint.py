@@ -6,9 +6,17 @@ from pathlib import Path
 import sys
 
 from autojob import logger
-from autojob.report import generate_report
-from autojob.tether import tether_constructor
-from autojob.file_utils import save_json, read_json
+from autojob.cache import DirectoryIndex, StatusCache, cache_path
+from autojob.detect import load_codes
+from autojob.diff import iter_saved_records, iter_transitions, write_transitions
+from autojob.progress import ProgressCache
+from autojob.report import CONFIG, generate_report
+from autojob.rollup import Rollup
+from autojob.runner import run_chunk, run_worker
+from autojob.store import JsonlWriter, ReportStore
+from autojob.tether import get_cost_function, tether_constructor
+from autojob.file_utils import save_json, read_json, DEFAULT_WORKERS
+from autojob.throttle import MetadataThrottle
 
 
 NOW = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
@@ -22,6 +30,124 @@ class SortingHelpFormatter(ArgumentDefaultsHelpFormatter, HelpFormatter):
         super(SortingHelpFormatter, self).add_arguments(actions)
 
 
+def add_search_arguments(subparser):
+    """Adds the arguments controlling the directory search to a subparser."""
+
+    subparser.add_argument(
+        "--index",
+        dest="index",
+        default=False,
+        action="store_true",
+        help="If specified, keeps a persistent index of the directory tree in "
+        "$HOME/.autojob/index, so that repeated searches only list the "
+        "directories which have changed since the last search.",
+    )
+
+    subparser.add_argument(
+        "--min-depth",
+        dest="min_depth",
+        type=int,
+        default=0,
+        help="Ignore directories shallower than this depth (the root has depth "
+        "0).",
+    )
+
+    subparser.add_argument(
+        "--max-depth",
+        dest="max_depth",
+        type=int,
+        default=None,
+        help="Do not search directories deeper than this depth.",
+    )
+
+    subparser.add_argument(
+        "--prune",
+        dest="prune",
+        action="append",
+        default=None,
+        help="Glob pattern for directory names which should not be searched, "
+        "e.g. '.git' or 'tether-staged-*'. May be given multiple times.",
+    )
+
+    subparser.add_argument(
+        "--stop-at-marker",
+        dest="stop_at_marker",
+        default=False,
+        action="store_true",
+        help="If specified, does not search below directories containing the "
+        "file being searched for.",
+    )
+
+    subparser.add_argument(
+        "--stat-entries",
+        dest="stat_entries",
+        default=False,
+        action="store_true",
+        help="If specified, records the sizes of files in the directories "
+        "found during the search, at the cost of one stat per file.",
+    )
+
+    subparser.add_argument(
+        "--max-metadata-ops",
+        dest="max_metadata_ops",
+        type=float,
+        default=None,
+        help="Maximum number of filesystem metadata operations (stat, "
+        "readdir, open) per second.",
+    )
+
+    subparser.add_argument(
+        "--adaptive-concurrency",
+        dest="adaptive_concurrency",
+        default=False,
+        action="store_true",
+        help="If specified, the number of concurrent filesystem operations is "
+        "scaled up and down based on their measured latency.",
+    )
+
+
+def get_search_kwargs(args, root, filename):
+    """Constructs the keyword arguments for
+    :func:`autojob.file_utils.exhaustive_directory_search` from the parsed
+    command line arguments.
+
+    Returns
+    -------
+    dict
+    """
+
+    search_kwargs = dict(
+        min_depth=args.min_depth,
+        max_depth=args.max_depth,
+        prune=args.prune,
+        stop_at_marker=args.stop_at_marker,
+        stat_entries=args.stat_entries,
+    )
+    if args.index:
+        markers = [filename] if isinstance(filename, str) else sorted(filename)
+        path = cache_path(args.autojob_root / Path("index"), root, *markers)
+        logger.debug(f"Using directory index {path}")
+        search_kwargs["index"] = DirectoryIndex.load(path)
+    return search_kwargs
+
+
+def get_throttle(args):
+    """Constructs the metadata throttle requested on the command line.
+
+    Returns
+    -------
+    autojob.throttle.MetadataThrottle or None
+    """
+
+    if args.max_metadata_ops is None and not args.adaptive_concurrency:
+        return None
+    return MetadataThrottle(
+        max_ops_per_second=args.max_metadata_ops,
+        max_concurrency=DEFAULT_WORKERS,
+        adaptive=args.adaptive_concurrency,
+    )
+
+
 def global_parser(sys_argv):
     ap = argparse.ArgumentParser(formatter_class=SortingHelpFormatter)
 
@@ -37,6 +163,7 @@ def global_parser(sys_argv):
     ap.add_argument(
         "--autojob-root",
         dest="autojob_root",
+        type=Path,
         default=Path.home() / Path(".autojob"),
     )
 
@@ -61,8 +188,192 @@ def global_parser(sys_argv):
         "-f",
         "--filename",
         dest="filename",
-        default="submit.sbatch",
-        help="Filename to search for.",
+        action="append",
+        default=None,
+        help="Filename to search for. Defaults to submit.sbatch. May be given "
+        "multiple times, in which case directories containing any of the "
+        "files are searched for.",
+    )
+
+    report_subparser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Number of threads used to check directories concurrently.",
+    )
+
+    report_subparser.add_argument(
+        "--cache",
+        dest="cache",
+        default=False,
+        action="store_true",
+        help="If specified, keeps a persistent cache of job statuses in "
+        "$HOME/.autojob/status, so that only jobs whose output files changed "
+        "since the last report are checked again.",
+    )
+
+    report_subparser.add_argument(
+        "--progress",
+        dest="progress",
+        default=False,
+        action="store_true",
+        help="If specified, estimates the progress of jobs which did not "
+        "complete (e.g. ionic steps for VASP). How far each output file was "
+        "parsed is saved in $HOME/.autojob/progress, so that the next report "
+        "only parses what was appended since.",
+    )
+
+    report_subparser.add_argument(
+        "--top-incomplete",
+        dest="top_incomplete",
+        type=int,
+        default=None,
+        help="If specified, counts the jobs under every directory below the "
+        "root, saves the counts to rollup.json (unless --no-json is "
+        "specified) and prints this many of the least complete directories. "
+        "Implies --progress, which tells running jobs from failed ones.",
+    )
+
+    report_subparser.add_argument(
+        "--rollup-depth",
+        dest="rollup_depth",
+        type=int,
+        default=None,
+        help="If specified, only directories at this depth below the root "
+        "are considered by --top-incomplete.",
+    )
+
+    report_subparser.add_argument(
+        "--errors",
+        dest="errors",
+        type=Path,
+        default=None,
+        help="Path to a json file of failure signatures, keyed by calculation "
+        "type, as lists of [filename pattern, signature, reason]. Overrides "
+        "the built-in catalogue for the calculation types it contains.",
+    )
+
+    report_subparser.add_argument(
+        "--store",
+        dest="store",
+        type=Path,
+        default=None,
+        help="Path to an SQLite database in which the status of every "
+        "directory is also saved. It can be filtered with autojob query.",
+    )
+
+    report_subparser.add_argument(
+        "--store-wal",
+        dest="store_wal",
+        default=False,
+        action="store_true",
+        help="If specified, the --store database uses write ahead logging, "
+        "so that it can be queried while the report is running. Only for "
+        "databases on local filesystems.",
+    )
+
+    report_subparser.add_argument(
+        "--jsonl",
+        dest="jsonl",
+        type=Path,
+        default=None,
+        help="Path to a file to which the status of every directory is "
+        "written as a json line as soon as it is checked. The file can be "
+        "followed while the report runs.",
+    )
+
+    report_subparser.add_argument(
+        "--no-json",
+        dest="json",
+        default=True,
+        action="store_false",
+        help="If specified, report.json is not written, and the paths of the "
+        "directories are not kept in memory. Combined with --jsonl or "
+        "--store, memory use does not grow with the number of directories.",
+    )
+
+    add_search_arguments(report_subparser)
+
+    query_subparser = subparsers.add_parser(
+        "query",
+        formatter_class=SortingHelpFormatter,
+        description="Lists the directories saved in a report store (see "
+        "report --store) matching all of the given filters.",
+    )
+
+    query_subparser.add_argument(
+        "store", type=Path, help="Path to the report store."
+    )
+
+    query_subparser.add_argument(
+        "--status",
+        dest="status",
+        default=None,
+        choices=["success", "fail", "unknown"],
+        help="Only directories with this status.",
+    )
+
+    query_subparser.add_argument(
+        "--ctype",
+        dest="ctype",
+        default=None,
+        help="Only directories of this calculation type.",
+    )
+
+    query_subparser.add_argument(
+        "--under",
+        dest="under",
+        default=None,
+        help="Only directories at or below this path, as it was saved.",
+    )
+
+    query_subparser.add_argument(
+        "--reason",
+        dest="reason",
+        default=None,
+        help="Only failed directories with this failure reason.",
+    )
+
+    query_subparser.add_argument(
+        "--limit",
+        dest="limit",
+        type=int,
+        default=None,
+        help="Maximum number of directories listed.",
+    )
+
+    query_subparser.add_argument(
+        "--count",
+        dest="count",
+        default=False,
+        action="store_true",
+        help="If specified, prints the number of matching directories of "
+        "each calculation type and status instead of listing them.",
+    )
+
+    diff_subparser = subparsers.add_parser(
+        "diff",
+        formatter_class=SortingHelpFormatter,
+        description="Lists the directories whose status changed between two "
+        "sets of saved results, as json lines. Results can be a report.json, "
+        "a report stream (.jsonl), a report store (.sqlite) or a status "
+        "cache.",
+    )
+
+    diff_subparser.add_argument("old", type=Path, help="The earlier results.")
+
+    diff_subparser.add_argument("new", type=Path, help="The current results.")
+
+    diff_subparser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        type=Path,
+        default=None,
+        help="File to which the changes are written. If not specified, they "
+        "are printed.",
     )
 
     tether_subparser = subparsers.add_parser(
@@ -84,6 +395,85 @@ def global_parser(sys_argv):
         "$HOME/.autojob/tether. The .json suffix is omitted.",
     )
 
+    tether_subparser.add_argument(
+        "--skip-completed",
+        dest="skip_completed",
+        default=False,
+        action="store_true",
+        help="If specified, calculations which already completed "
+        "successfully (according to the report checks) are not tethered.",
+    )
+
+    tether_subparser.add_argument(
+        "--skip-queued",
+        dest="skip_queued",
+        default=False,
+        action="store_true",
+        help="If specified, calculations which are currently in the SLURM "
+        "queue are not tethered.",
+    )
+
+    tether_subparser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Number of threads used to check whether calculations "
+        "completed.",
+    )
+
+    add_search_arguments(tether_subparser)
+
+    work_subparser = subparsers.add_parser(
+        "work",
+        formatter_class=SortingHelpFormatter,
+        description="Runs calculations from a tether work queue until it is "
+        "empty. Used by the staged jobs written in the queue tether mode.",
+    )
+
+    work_subparser.add_argument(
+        "queue", type=Path, help="Path to the work queue directory."
+    )
+
+    work_subparser.add_argument(
+        "--slots",
+        dest="slots",
+        type=int,
+        default=1,
+        help="Number of calculations run at the same time.",
+    )
+
+    chunk_subparser = subparsers.add_parser(
+        "run-chunk",
+        formatter_class=SortingHelpFormatter,
+        description="Runs a chunk of calculations and records the exit code, "
+        "runtime, CPU time and peak memory of each. Used by the staged jobs "
+        "written in the chunk tether mode.",
+    )
+
+    chunk_subparser.add_argument(
+        "chunk", type=Path, help="Path to the chunk file."
+    )
+
+    chunk_subparser.add_argument(
+        "--slots",
+        dest="slots",
+        type=int,
+        default=None,
+        help="Number of calculations run at the same time. Defaults to all "
+        "of them.",
+    )
+
+    chunk_subparser.add_argument(
+        "--manifest",
+        dest="manifest",
+        type=Path,
+        default=None,
+        help="File to which the records of the calculations are appended. "
+        "Defaults to manifest.jsonl next to the chunk file.",
+    )
+
     return ap.parse_args(sys_argv)
 
 
@@ -99,9 +489,116 @@ def entrypoint(args=sys.argv[1:]):
     args = global_parser(args)
     logger.debug(f"Command line args: {args}")
 
+    # Codes registered by the user are identified by both the report and the
+    # tether, so that they agree on the status of every directory
+    codes = CONFIG
+    codes_path = args.autojob_root / Path("codes.json")
+    if args.runtype in ("report", "tether") and codes_path.exists():
+        logger.debug(f"Registering codes from {codes_path}")
+        codes = load_codes(codes_path, CONFIG)
+
     if args.runtype == "report":
-        d = generate_report(args.root, args.filename)
-        save_json(d, Path(args.root) / Path("report.json"))
+        if args.filename is None:
+            args.filename = ["submit.sbatch"]
+        if args.top_incomplete is not None:
+            args.progress = True
+        search_kwargs = get_search_kwargs(args, args.root, args.filename)
+        cache = None
+        if args.cache:
+            path = cache_path(
+                args.autojob_root / Path("status"),
+                args.root,
+                *sorted(args.filename),
+            )
+            logger.debug(f"Using status cache {path}")
+            cache = StatusCache.load(path)
+        errors = codes["errors"]
+        if args.errors is not None:
+            errors = dict(errors, **read_json(args.errors))
+        store = None
+        if args.store is not None:
+            store = ReportStore(args.store, wal=args.store_wal)
+        progress = None
+        if args.progress:
+            path = cache_path(
+                args.autojob_root / Path("progress"),
+                args.root,
+                *sorted(args.filename),
+            )
+            logger.debug(f"Using progress cache {path}")
+            progress = ProgressCache.load(path)
+        rollup = None
+        if args.top_incomplete is not None:
+            rollup = Rollup(args.root)
+        stream = None
+        if args.jsonl is not None:
+            stream = JsonlWriter(args.jsonl)
+        d = generate_report(
+            args.root,
+            args.filename,
+            search_kwargs=search_kwargs,
+            throttle=get_throttle(args),
+            jobs=args.jobs,
+            cache=cache,
+            errors=errors,
+            store=store,
+            stream=stream,
+            keep_paths=args.json,
+            progress=progress,
+            input_files=codes["in"],
+            output_files=codes["out"],
+            rollup=rollup,
+        )
+        if args.json:
+            save_json(d, Path(args.root) / Path("report.json"))
+        else:
+            logger.info(f"Report summary: {d}")
+        if rollup is not None:
+            if args.json:
+                save_json(
+                    rollup.to_dict(),
+                    Path(args.root) / Path("rollup.json"),
+                    indent=None,
+                )
+            for path, fraction, counts in rollup.least_complete(
+                args.top_incomplete, args.rollup_depth
+            ):
+                logger.info(f"{fraction:7.1%} {path} {counts}")
+        if store is not None:
+            store.close()
+        if stream is not None:
+            stream.close()
+        if args.index:
+            search_kwargs["index"].save()
+        if args.cache:
+            cache.save()
+        if args.progress:
+            progress.save()
+
+    elif args.runtype == "query":
+        if not args.store.exists():
+            raise FileNotFoundError(f"Report store {args.store} does not exist")
+        filters = dict(
+            status=args.status,
+            ctype=args.ctype,
+            under=args.under,
+            reason=args.reason,
+        )
+        with ReportStore(args.store) as store:
+            if args.count:
+                for (ctype, status), count in sorted(
+                    store.counts(**filters).items(), key=str
+                ):
+                    print(f"{ctype}\t{status}\t{count}")
+            else:
+                for row in store.query(limit=args.limit, **filters):
+                    print(row["path"])
+
+    elif args.runtype == "diff":
+        transitions = iter_transitions(
+            lambda: iter_saved_records(args.old), iter_saved_records(args.new)
+        )
+        write_transitions(transitions, args.output)
 
     elif args.runtype == "modify":
         pass
@@ -113,6 +610,8 @@ def entrypoint(args=sys.argv[1:]):
         if staging_name is None:
             staging_name = f"tether-staged-{NOW}"
         target_directory = Path.cwd() / Path(staging_name)
+        search_kwargs = get_search_kwargs(args, args.root, config["filename"])
+        search_kwargs["throttle"] = get_throttle(args)
         tether_constructor(
             args.root,
             config["filename"],
@@ -120,7 +619,25 @@ def entrypoint(args=sys.argv[1:]):
             config["calculations_per_staged_job"],
             config["slurm_header_lines"],
             config["executable"],
+            search_kwargs=search_kwargs,
+            packing=config.get("packing", "order"),
+            cost=get_cost_function(config.get("cost"), config.get("runtimes")),
+            mode=config.get("mode", "bash"),
+            slots=config.get("slots"),
+            skip_completed=args.skip_completed,
+            skip_queued=args.skip_queued,
+            jobs=args.jobs,
+            input_files=codes["in"],
+            output_files=codes["out"],
         )
+        if args.index:
+            search_kwargs["index"].save()
+
+    elif args.runtype == "work":
+        run_worker(args.queue, args.slots)
+
+    elif args.runtype == "run-chunk":
+        run_chunk(args.chunk, args.slots, args.manifest)
 
     else:
         raise RuntimeError(f"Unknown runtime type {args.runtype}")
@@ -1,8 +1,22 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import fnmatchcase
+from functools import lru_cache
 import json
+import mmap
+import os
+import re
 from pathlib import Path
 from subprocess import Popen, PIPE
 from time import time
-from sys import platform
+
+from autojob import logger
+from autojob.throttle import NULL_THROTTLE
+
+
+# Directory listing on shared filesystems is bound by metadata latency, so it
+# is worth using more threads than there are cores
+DEFAULT_WORKERS = min(32, 4 * (os.cpu_count() or 1))
 
 
 def save_json(d, path, indent=4, sort_keys=False):
@@ -76,48 +90,723 @@ def run_command(cmd):
     }
 
 
-def _exhaustive_directory_search_linux_darwin(root, filename):
-    """Executes a recursive directory search using the ``find`` bash command.
-    
+def _stat_or_none(entry, throttle=NULL_THROTTLE):
+    """Gets the (size, modification time) of a directory entry, following
+    symbolic links, or None if it cannot be accessed (e.g. a broken link).
+
     Parameters
     ----------
-    root : os.PathLike
-    filename : str
+    entry : os.DirEntry or str
+    throttle : autojob.throttle.MetadataThrottle, optional
 
     Returns
     -------
-    list of os.PathLike
+    tuple or None
+    """
+
+    try:
+        with throttle.op():
+            if isinstance(entry, os.DirEntry):
+                st = entry.stat()
+            else:
+                st = os.stat(entry)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _scan_directory(
+    path, markers, index=None, stat_entries=False, throttle=NULL_THROTTLE
+):
+    """Lists a single directory, determining whether it contains any of the
+    marker files and which of its entries are subdirectories. The entry type
+    is taken from ``os.scandir`` (``d_type`` on Linux), so no per-entry
+    ``stat`` call is made. Symbolic links to directories are not followed,
+    matching the behavior of ``find``.
+
+    Parameters
+    ----------
+    path : str
+    markers : set of str
+    index : autojob.cache.DirectoryIndex, optional
+        If provided, the directory is only listed if its modification time
+        differs from the one recorded in the index. Otherwise the cached
+        result is returned.
+    stat_entries : bool, optional
+        If True, the files of directories containing a marker are ``stat``-ed.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        Every filesystem call is made through this throttle.
+
+    Returns
+    -------
+    tuple
+        The listing of the directory if it contains a marker file (None
+        otherwise), and a list of the absolute paths to the subdirectories.
+        The listing is a dictionary keyed by the names of the files (anything
+        that is not a directory) in the directory. Its values are None, or
+        (size, modification time in ns) if ``stat_entries`` is True.
+    """
+
+    if index is not None:
+        try:
+            with throttle.op():
+                mtime_ns = os.stat(path).st_mtime_ns
+        except OSError as err:
+            logger.warning(f"Cannot scan {path}: {err}")
+            return None, []
+        cached = index.lookup(path, mtime_ns)
+        if cached is not None:
+            listing, subdirectories = cached
+            if listing is not None and stat_entries:
+                for name in listing:
+                    fullname = os.path.join(path, name)
+                    listing[name] = _stat_or_none(fullname, throttle)
+            return listing, subdirectories
+
+    files = []
+    subdirectories = []
+    try:
+        with throttle.op(), os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                else:
+                    files.append(entry)
+    except OSError as err:
+        # Including e.g. stale file handles or I/O errors on shared filesystems
+        logger.warning(f"Cannot scan {path}: {err}")
+        return None, subdirectories
+
+    listing = None
+    if any(entry.name in markers for entry in files):
+        if stat_entries:
+            listing = {
+                entry.name: _stat_or_none(entry, throttle) for entry in files
+            }
+        else:
+            listing = {entry.name: None for entry in files}
+
+    if index is not None:
+        index.update(path, mtime_ns, listing, subdirectories)
+    return listing, subdirectories
+
+
+def _should_descend(subdirectory, depth, max_depth, prune):
+    """Determines whether a subdirectory should be searched.
+
+    Parameters
+    ----------
+    subdirectory : str
+    depth : int
+        The depth of the subdirectory relative to the search root.
+    max_depth : int or None
+    prune : list of str or None
+
+    Returns
+    -------
+    bool
+    """
+
+    if max_depth is not None and depth > max_depth:
+        return False
+    if prune:
+        name = os.path.basename(subdirectory)
+        return not any(fnmatchcase(name, pattern) for pattern in prune)
+    return True
+
+
+def iter_directory_search(
+    root,
+    filename,
+    max_workers=DEFAULT_WORKERS,
+    index=None,
+    min_depth=0,
+    max_depth=None,
+    prune=None,
+    stop_at_marker=False,
+    with_listing=False,
+    stat_entries=False,
+    throttle=None,
+):
+    """Lazily executes an exhaustive, recursive directory search, yielding
+    directories containing a file matching the provided file name as soon as
+    they are found. Directories are listed in background threads, so the walk
+    continues while the caller processes the directories already yielded.
+    The order of the results is not deterministic.
+
+    Parameters
+    ----------
+    root : os.PathLike
+        The path (absolute or relative) to the directory from which to conduct
+        the exhaustive search.
+    filename : str or list of str
+        The exact name of the file which identifies a directory as one of
+        interest. If a list, directories containing any of the files are
+        identified.
+    max_workers : int, optional
+        The maximum number of threads used to list directories. If 1, the
+        search is performed serially in the calling thread.
+    index : autojob.cache.DirectoryIndex, optional
+        A persistent index of a previous search over the same tree. Each
+        directory is still ``stat``-ed (a change deep in the tree does not
+        change the modification time of its ancestors), but only directories
+        whose modification time changed are listed again. The index is updated
+        in place; it is up to the caller to save it.
+    min_depth : int, optional
+        Directories shallower than this are searched but never yielded. The
+        root itself has depth 0. Same semantics as ``find -mindepth``.
+    max_depth : int, optional
+        Directories deeper than this are not searched. Same semantics as
+        ``find -maxdepth``.
+    prune : list of str, optional
+        Glob patterns (e.g. ``".git"`` or ``"tether-staged-*"``) matched
+        against directory names. Matching directories, and everything below
+        them, are not searched.
+    stop_at_marker : bool, optional
+        If True, the subdirectories of a directory containing the marker file
+        are not searched.
+    with_listing : bool, optional
+        If True, the listing of each directory recorded during the search is
+        yielded alongside it, so that callers need not list it again.
+    stat_entries : bool, optional
+        If True, the listings contain the sizes and modification times of the
+        files. This costs one ``stat`` call per file in every directory found.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        If provided, limits the rate and concurrency of the filesystem calls
+        made by the search. The thread pool still never exceeds
+        ``max_workers`` threads.
+
+    Yields
+    ------
+    Path or tuple
+        A directory containing the filename provided. If ``with_listing`` is
+        True, a tuple of the directory and a dictionary keyed by the names of
+        the files it contains, with values of None or (size, modification time
+        in ns) if ``stat_entries`` is True.
     """
 
-    find_command = f'find {root} -name "{filename}"'
-    out = run_command(find_command)
-    if int(out["exitcode"]) != 0:
-        raise RuntimeError(f"Unknown error running `find` {out}")
-    return out["stdout"].split()
+    root = os.fspath(root)
+    markers = {filename} if isinstance(filename, str) else set(filename)
+    if throttle is None:
+        throttle = NULL_THROTTLE
+    scan_args = (markers, index, stat_entries, throttle)
+    if index is not None:
+        index.begin()
+
+    def process(depth, listing, subdirectories):
+        if depth < min_depth:
+            listing = None
+        if listing is not None and stop_at_marker:
+            subdirectories = []
+        children = [
+            xx
+            for xx in subdirectories
+            if _should_descend(xx, depth + 1, max_depth, prune)
+        ]
+        return listing, children
+
+    def result(path, listing):
+        return (Path(path), listing) if with_listing else Path(path)
+
+    if max_workers <= 1:
+        stack = [(root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            listing, children = process(
+                depth, *_scan_directory(path, *scan_args)
+            )
+            stack.extend((xx, depth + 1) for xx in children)
+            if listing is not None:
+                yield result(path, listing)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future = executor.submit(_scan_directory, root, *scan_args)
+        pending = {future: (root, 0)}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = pending.pop(future)
+                    listing, children = process(depth, *future.result())
+
+                    # Queue the subdirectories before handing the hit back to
+                    # the caller, so that the walk continues in the meantime
+                    for child in children:
+                        future = executor.submit(
+                            _scan_directory, child, *scan_args
+                        )
+                        pending[future] = (child, depth + 1)
+                    if listing is not None:
+                        yield result(path, listing)
+        finally:
+            # Only relevant if the caller stops consuming early
+            for future in pending:
+                future.cancel()
 
-def exhaustive_directory_search(root, filename):
+
+def _sort_key(result):
+    return result[0] if isinstance(result, tuple) else result
+
+
+def exhaustive_directory_search(root, filename, **kwargs):
     """Executes an exhaustive, recursive directory search of all downstream
     directories, finding directories which contain a file matching the provided
     file name query string.
 
+    The search is performed in-process with ``os.scandir``. Directories are
+    listed concurrently by a bounded pool of threads, since on shared
+    filesystems the walk is dominated by metadata latency rather than CPU.
+
     Parameters
     ----------
     root : os.PathLike
         The path (absolute or relative) to the directory from which to conduct
         the exhaustive search.
-    filename : str
+    filename : str or list of str
         The exact name of the file which identifies a directory as one of
-        interest.
+        interest. If a list, directories containing any of the files are
+        identified.
+    **kwargs
+        Keyword arguments passed to :func:`iter_directory_search`.
+
+    Returns
+    -------
+    list of Path
+        A sorted list of directories containing the filename provided. If
+        ``with_listing`` is True, a sorted list of (directory, listing)
+        tuples.
+    """
+
+    return sorted(
+        iter_directory_search(root, filename, **kwargs), key=_sort_key
+    )
+
+
+def imap_unordered(function, iterable, max_workers, max_in_flight=None):
+    """Lazily applies a function to every item of a (possibly lazy) iterable
+    using a pool of threads, yielding results in completion order. At most
+    ``max_in_flight`` items are consumed ahead of the results, so arbitrarily
+    long iterables can be processed in bounded memory.
+
+    Parameters
+    ----------
+    function : callable
+    iterable : iterable
+    max_workers : int
+        The number of threads. If 1, items are processed serially in the
+        calling thread.
+    max_in_flight : int, optional
+        Defaults to four times the number of threads.
+
+    Yields
+    ------
+    The results of the function.
+    """
+
+    if max_workers <= 1:
+        for item in iterable:
+            yield function(item)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 4 * max_workers
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        try:
+            for item in iterable:
+                pending.add(executor.submit(function, item))
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                else:
+                    done = {xx for xx in pending if xx.done()}
+                    pending -= done
+                for future in done:
+                    yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def tail_from_blocks(blocks, n_lines=100, max_bytes=None):
+    """Collects the end of some data, given as blocks read backwards from its
+    end. Blocks are only consumed until enough lines (or bytes) have been
+    collected.
+
+    Parameters
+    ----------
+    blocks : iterable of bytes
+        Consecutive blocks of the data, starting with the last one.
+    n_lines : int, optional
+        The number of trailing lines to return. If None, only ``max_bytes``
+        limits the amount collected.
+    max_bytes : int, optional
+        The maximum number of trailing bytes to collect. If None, only
+        ``n_lines`` limits the amount collected.
+
+    Returns
+    -------
+    bytes
+        The trailing lines, including the final newline if present.
+    """
+
+    if n_lines is None and max_bytes is None:
+        raise ValueError("At least one of n_lines and max_bytes is required")
+    if n_lines == 0:
+        return b""
+
+    collected = []
+    n_read = 0
+    trailing = 0
+    n_newlines = 0
+    for block in blocks:
+        if max_bytes is not None:
+            if n_read >= max_bytes:
+                break
+            block = block[max(0, len(block) - (max_bytes - n_read)) :]
+        if not block:
+            continue
+        if not collected and block.endswith(b"\n"):
+            trailing = 1
+        collected.append(block)
+        n_read += len(block)
+
+        # A newline is needed before the first line to know it is complete
+        if n_lines is not None:
+            n_newlines += block.count(b"\n")
+            if n_newlines > n_lines - 1 + trailing:
+                break
+
+    data = b"".join(reversed(collected))
+    if n_lines is None:
+        return data
+    lines = data.split(b"\n")
+    return b"\n".join(lines[-(n_lines + trailing) :])
+
+
+def _reverse_blocks(f, block_size):
+    """Reads an open binary file backwards in blocks, starting at its end."""
+
+    pos = f.seek(0, os.SEEK_END)
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        f.seek(pos)
+        yield f.read(size)
+
+
+def tail(path, n_lines=100, max_bytes=None, block_size=65536):
+    """Reads the end of a file, equivalent to ``tail -n`` but without spawning
+    a process. The file is read backwards in fixed-size blocks until enough
+    lines (or bytes) have been collected, so the cost does not depend on the
+    size of the file.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    n_lines : int, optional
+        The number of trailing lines to return. If None, only ``max_bytes``
+        limits the amount read.
+    max_bytes : int, optional
+        The maximum number of trailing bytes to read. If None, only
+        ``n_lines`` limits the amount read.
+    block_size : int, optional
+        The number of bytes to read at a time.
+
+    Returns
+    -------
+    bytes
+        The trailing lines, including the final newline if present.
+    """
+
+    with open(path, "rb") as f:
+        blocks = _reverse_blocks(f, block_size)
+        return tail_from_blocks(blocks, n_lines, max_bytes)
+
+
+class SignatureMatcher:
+    """Searches a buffer for many literal signatures at once. All signatures
+    are compiled into a single regular expression, so the buffer is scanned
+    once regardless of the number of signatures, and the scan stops as soon
+    as every signature has been found.
+
+    The expression is a lookahead, so that it is attempted at every position
+    of the buffer and overlapping signatures are all found. Where several
+    signatures start at the same position, only the longest is matched by the
+    expression, but the others are then prefixes of it and are found as such.
+
+    Parameters
+    ----------
+    signatures : iterable of str
+    """
+
+    @property
+    def signatures(self):
+        return self._signatures
+
+    @property
+    def max_length(self):
+        """The length in bytes of the longest signature."""
+
+        return max(self._lengths.values(), default=0)
+
+    def __init__(self, signatures):
+        self._signatures = sorted(set(signatures), key=len, reverse=True)
+        encoded = {xx: xx.encode() for xx in self._signatures}
+        self._lengths = {xx: len(yy) for xx, yy in encoded.items()}
+        self._prefixes = {
+            yy: [xx for xx in self._signatures if yy.startswith(encoded[xx])]
+            for yy in encoded.values()
+        }
+        alternatives = b"|".join(re.escape(xx) for xx in encoded.values())
+        self._pattern = re.compile(b"(?=(" + alternatives + b"))")
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def length(self, signature):
+        """The length in bytes of a signature."""
+
+        return self._lengths[signature]
+
+    def iter_matches(self, data, start=0, end=None):
+        """Finds every position at which signatures start.
+
+        Parameters
+        ----------
+        data : bytes-like
+            Any object supporting the buffer protocol, e.g. bytes or mmap.
+        start, end : int, optional
+            The range of the buffer to search.
+
+        Yields
+        ------
+        tuple
+            The position, and the list of signatures starting there.
+        """
+
+        if not self._signatures:
+            return
+        if end is None:
+            end = len(data)
+        for match in self._pattern.finditer(data, start, end):
+            yield match.start(), self._prefixes[match.group(1)]
+
+    def search(self, data, start=0, end=None):
+        """Finds which signatures are present in a buffer.
+
+        Parameters
+        ----------
+        data : bytes-like
+            Any object supporting the buffer protocol, e.g. bytes or mmap.
+        start, end : int, optional
+            The range of the buffer to search.
+
+        Returns
+        -------
+        set of str
+        """
+
+        found = set()
+        for _, signatures in self.iter_matches(data, start, end):
+            found.update(signatures)
+            if len(found) == len(self._signatures):
+                break
+        return found
+
+    def count(self, data, start=0, end=None):
+        """Counts the occurrences of every signature in a buffer. Unlike
+        :meth:`search`, this always scans the entire range.
+
+        Parameters
+        ----------
+        data : bytes-like
+        start, end : int, optional
+
+        Returns
+        -------
+        collections.Counter
+        """
+
+        counts = Counter({xx: 0 for xx in self._signatures})
+        for _, signatures in self.iter_matches(data, start, end):
+            counts.update(signatures)
+        return counts
+
+
+@lru_cache(maxsize=256)
+def compile_signatures(signatures):
+    """Gets a (cached) :class:`SignatureMatcher`.
+
+    Parameters
+    ----------
+    signatures : tuple of str
+
+    Returns
+    -------
+    SignatureMatcher
+    """
+
+    return SignatureMatcher(signatures)
+
+
+def scan_file(path, matcher, start=None, end=None, count=False):
+    """Searches a byte range of a file for signatures through a memory map,
+    without reading the file into memory. Only the pages touched by the scan
+    are read from disk, so scanning the end of a multi-gigabyte file is cheap,
+    and scanning all of it does not copy it into Python objects.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    matcher : SignatureMatcher
+    start, end : int, optional
+        The byte range to scan. Negative values are relative to the end of the
+        file. Defaults to the whole file.
+    count : bool, optional
+        If True, counts the occurrences of every signature instead.
+
+    Returns
+    -------
+    set of str or collections.Counter
+        The result of :meth:`SignatureMatcher.search` (or
+        :meth:`SignatureMatcher.count`).
+    """
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end, _ = slice(start, end).indices(size)
+        if size == 0 or start >= end:
+            return Counter() if count else set()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if count:
+                return matcher.count(mm, start, end)
+            return matcher.search(mm, start, end)
+
+
+def geometric_sizes(initial, growth, max_bytes=None):
+    """Sizes of consecutive blocks such that the total size after each block
+    grows geometrically: ``initial``, ``initial * growth``, and so on, up to
+    ``max_bytes``.
+
+    Parameters
+    ----------
+    initial : int
+    growth : float
+        Must be greater than 1.
+    max_bytes : int, optional
+        If None, the sizes are unbounded.
+
+    Yields
+    ------
+    int
+    """
+
+    if growth <= 1:
+        raise ValueError(f"growth must be greater than 1, got {growth}")
+    total = 0
+    target = initial
+    while max_bytes is None or total < max_bytes:
+        if max_bytes is not None:
+            target = min(target, max_bytes)
+        yield int(target) - total
+        total = int(target)
+        target *= growth
+
+
+def _reverse_sized_blocks(f, sizes):
+    """Reads an open binary file backwards, in blocks of the given sizes."""
+
+    pos = f.seek(0, os.SEEK_END)
+    for size in sizes:
+        if pos == 0:
+            return
+        size = min(size, pos)
+        pos -= size
+        f.seek(pos)
+        yield f.read(size)
+
+
+def search_reverse_blocks(blocks, matcher, required=None):
+    """Searches data given as blocks read backwards from its end, and stops
+    reading blocks as soon as every required signature has been found.
+    Signatures spanning the boundary between two blocks are found as well.
+
+    Parameters
+    ----------
+    blocks : iterable of bytes
+        Consecutive blocks of the data, starting with the last one.
+    matcher : SignatureMatcher
+    required : iterable of str, optional
+        The signatures which must all be found for the search to stop.
+        Other signatures are only searched for in the blocks read until
+        then. Defaults to all the signatures of the matcher.
+
+    Returns
+    -------
+    set of str
+    """
+
+    if required is None:
+        required = matcher.signatures
+    required = set(required)
+    found = set()
+    overlap = max(matcher.max_length - 1, 0)
+    head = b""
+    for block in blocks:
+        buffer = block + head
+        for position, signatures in matcher.iter_matches(buffer):
+            # Signatures starting in the previous block were already found
+            if position >= len(block):
+                break
+            found.update(signatures)
+            if len(found) == len(matcher):
+                return found
+        if required <= found:
+            return found
+        head = buffer[:overlap]
+    return found
+
+
+def search_tail(
+    path, matcher, initial=4096, max_bytes=1 << 20, growth=4, required=None
+):
+    """Searches the end of a file for signatures, reading a small trailing
+    block first and growing the amount read geometrically until all the
+    required signatures are found or ``max_bytes`` have been read. Completion
+    messages are usually within the last few lines of a file, so most files
+    are settled with a single small read, while messages followed by long
+    trailing output are still found.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    matcher : SignatureMatcher
+    initial : int, optional
+        The number of trailing bytes read first.
+    max_bytes : int, optional
+        The maximum number of trailing bytes read. If None, the whole file
+        may be read.
+    growth : float, optional
+        The factor by which the amount read grows at every step.
+    required : iterable of str, optional
+        See :func:`search_reverse_blocks`.
 
     Returns
     -------
-    list of os.PathLike
-        A list of directories containing the filename provided.
+    set of str
     """
 
-    if platform in ["linux", "linux2", "darwin"]:
-        return _exhaustive_directory_search_linux_darwin(root, filename)
-    return [xx.parent for xx in Path(root).rglob(filename)]
+    with open(path, "rb") as f:
+        blocks = _reverse_sized_blocks(
+            f, geometric_sizes(initial, growth, max_bytes)
+        )
+        return search_reverse_blocks(blocks, matcher, required)
 
 
 def check_if_substring_match(lines, substring):
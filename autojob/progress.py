@@ -0,0 +1,245 @@
+"""Progress estimates for running jobs. Output files of running jobs only grow,
+so instead of reading them in full every time, the :class:`ProgressCache`
+records how far each file was parsed and the state of its parser, and only
+the bytes appended since are parsed on the next report.
+
+Parsers are functions taking a list of complete lines (as bytes) and the
+state returned for the previous lines of the file (an empty dictionary at
+its start), and returning the new state. States must be json-serializable.
+"""
+
+from hashlib import sha1
+import os
+import re
+
+from autojob import logger
+from autojob.cache import JsonCache
+from autojob.throttle import NULL_THROTTLE
+
+
+# Amount of data read at a time
+CHUNK_SIZE = 1 << 20
+
+# Number of bytes before the parsed offset used to detect that a file was
+# replaced by another one at least as long
+GUARD_SIZE = 64
+
+_OSZICAR_IONIC = re.compile(rb"^\s*(\d+)\s+F=\s*(\S+)")
+_OSZICAR_SCF = re.compile(rb"^\s*[A-Z]{3}:\s+(\d+)")
+_OUTCAR_ITERATION = re.compile(rb"Iteration\s+(\d+)\(\s*(\d+)\)")
+
+# FEFF stages, in the order in which they are run, as printed to feff.out
+FEFF_STAGES = [
+    [b"Calculating atomic potentials", "potentials"],
+    [b"Calculating SCF potentials", "scf"],
+    [b"Calculating cross-section", "xsph"],
+    [b"Calculating paths", "paths"],
+    [b"Calculating full multiple scattering", "fms"],
+    [b"Calculating EXAFS parameters", "genfmt"],
+    [b"Calculating XAS spectra", "ff2x"],
+    [b"feff ends at", "done"],
+]
+
+
+def parse_oszicar(lines, state):
+    """Counts the completed ionic steps and the electronic steps of the
+    current ionic step in a VASP OSZICAR."""
+
+    state = dict({"ionic_steps": 0, "scf_steps": 0}, **state)
+    for line in lines:
+        match = _OSZICAR_IONIC.match(line)
+        if match is not None:
+            state["ionic_steps"] = int(match.group(1))
+            state["scf_steps"] = 0
+            try:
+                state["energy"] = float(match.group(2))
+            except ValueError:
+                pass
+            continue
+        match = _OSZICAR_SCF.match(line)
+        if match is not None:
+            state["scf_steps"] = int(match.group(1))
+    return state
+
+
+def parse_outcar(lines, state):
+    """Counts the completed ionic steps and the electronic steps of the
+    current ionic step in a VASP OUTCAR."""
+
+    state = dict({"ionic_steps": 0, "scf_steps": 0}, **state)
+    for line in lines:
+        match = _OUTCAR_ITERATION.search(line)
+        if match is not None:
+            state["ionic_steps"] = int(match.group(1)) - 1
+            state["scf_steps"] = int(match.group(2))
+    return state
+
+
+def parse_feff_out(lines, state):
+    """Determines the last stage of FEFF started, and counts the iterations of
+    the self-consistent potential calculation."""
+
+    state = dict({"stage": None, "stages": 0, "scf_iterations": 0}, **state)
+    for line in lines:
+        if b"mu_old=" in line:
+            state["scf_iterations"] += 1
+            continue
+        for ii, (signature, stage) in enumerate(FEFF_STAGES):
+            if ii >= state["stages"] and signature in line:
+                state["stage"] = stage
+                state["stages"] = ii + 1
+                break
+    return state
+
+
+PARSERS = {
+    "oszicar": parse_oszicar,
+    "outcar": parse_outcar,
+    "feff": parse_feff_out,
+}
+
+
+class ProgressCache(JsonCache):
+    """An on-disk record of how far the output files of running jobs were
+    parsed. Each entry holds the byte offset up to which a file was parsed,
+    the parser state at that offset, and the inode of the file and a hash of
+    the bytes preceding the offset, which are used to detect that the file was
+    replaced (e.g. by a restarted job) and must be parsed from the start."""
+
+    VERSION = 1
+
+    def lookup(self, path, parser, ino):
+        """Gets the offset and the parser state of a file.
+
+        Parameters
+        ----------
+        path : str
+        parser : str
+            The name of the parser in :data:`PARSERS`.
+        ino : int
+
+        Returns
+        -------
+        tuple
+            The offset, the state and the guard hash, or (0, {}, None) if the
+            file was not parsed before.
+        """
+
+        cached = self._get(path)
+        if cached is None or cached["parser"] != parser or cached["ino"] != ino:
+            return 0, dict(), None
+        return cached["offset"], cached["state"], cached["guard"]
+
+    def update(self, path, parser, ino, offset, state, guard):
+        self._set(
+            path,
+            {
+                "parser": parser,
+                "ino": ino,
+                "offset": offset,
+                "state": state,
+                "guard": guard,
+            },
+        )
+
+
+def _iter_complete_lines(f):
+    """Reads chunks of complete lines from the current position of a binary
+    file. An incomplete last line is not returned.
+
+    Yields
+    ------
+    tuple
+        The lines, and the number of bytes they span.
+    """
+
+    remainder = b""
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        data = remainder + chunk
+        end = data.rfind(b"\n") + 1
+        remainder = data[end:]
+        if end:
+            yield data[:end].splitlines(), end
+
+
+def parse_progress(path, parser, cache=None, throttle=NULL_THROTTLE):
+    """Parses the progress of a job from one of its output files, starting
+    from where the previous call left off.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    parser : str
+        The name of the parser in :data:`PARSERS`.
+    cache : ProgressCache, optional
+        If not provided, the file is parsed from the start.
+    throttle : autojob.throttle.MetadataThrottle, optional
+
+    Returns
+    -------
+    dict
+        The parser state.
+    """
+
+    key = os.fspath(path)
+    function = PARSERS[parser]
+    with throttle.read(), open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        offset, state, guard = 0, dict(), None
+        if cache is not None:
+            offset, state, guard = cache.lookup(key, parser, st.st_ino)
+
+        # Start over if the file shrank or the bytes before the offset changed
+        if offset > st.st_size:
+            offset, state = 0, dict()
+        elif offset > 0:
+            f.seek(offset - min(offset, GUARD_SIZE))
+            if sha1(f.read(min(offset, GUARD_SIZE))).hexdigest() != guard:
+                offset, state = 0, dict()
+        f.seek(offset)
+
+        if not state:
+            state = function([], state)
+        for lines, size in _iter_complete_lines(f):
+            state = function(lines, state)
+            offset += size
+
+        if cache is not None:
+            f.seek(offset - min(offset, GUARD_SIZE))
+            guard = sha1(f.read(min(offset, GUARD_SIZE))).hexdigest()
+            cache.update(key, parser, st.st_ino, offset, state, guard)
+    return state
+
+
+def job_progress(directory, sources, cache=None, throttle=NULL_THROTTLE):
+    """Estimates the progress of a job.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+    sources : list of list of str
+        Alternative [filename, parser] pairs. The first file which exists is
+        parsed.
+    cache : ProgressCache, optional
+    throttle : autojob.throttle.MetadataThrottle, optional
+
+    Returns
+    -------
+    dict or None
+        The parser state, or None if none of the files exist or can be
+        parsed.
+    """
+
+    for filename, parser in sources:
+        path = os.path.join(directory, filename)
+        try:
+            return parse_progress(path, parser, cache, throttle)
+        except FileNotFoundError:
+            continue
+        except (OSError, UnicodeDecodeError) as err:
+            logger.debug(f"Could not parse the progress of {path}: {err}")
+            continue
+    return None
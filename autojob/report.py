@@ -8,14 +8,33 @@
 """
 
 from collections import Counter
+from fnmatch import fnmatchcase
+import json
+import os
 from pathlib import Path
 
 from autojob import logger
+from autojob.cache import file_signature
+from autojob.compression import (
+    COMPRESSION_SUFFIXES,
+    DECOMPRESSION_ERRORS,
+    is_compressed,
+    open_decompressed,
+    scan_compressed,
+    search_tail_compressed,
+    tail_compressed,
+)
+from autojob.detect import get_detector
+from autojob.progress import job_progress
+from autojob.throttle import NULL_THROTTLE
 
 from autojob.file_utils import (
-    exhaustive_directory_search,
-    run_command,
-    check_if_substring_match,
+    imap_unordered,
+    iter_directory_search,
+    tail,
+    compile_signatures,
+    scan_file,
+    search_tail,
 )
 
 
@@ -35,8 +54,143 @@ CONFIG = {
     },
 }
 
+# Known failure signatures, as [filename pattern, signature, reason] lists.
+# The patterns are globs matched against the names of the files in the
+# directory.
+_SLURM_ERRORS = [
+    [pattern, signature, reason]
+    for pattern in ["*.err", "slurm-*.out"]
+    for signature, reason in [
+        ["oom-kill", "out of memory"],
+        ["out-of-memory handler", "out of memory"],
+        ["DUE TO TIME LIMIT", "time limit"],
+    ]
+]
+CONFIG["errors"] = {
+    "FEFF": [
+        ["feff.out", "Convergence not reached", "SCF not converged"],
+    ]
+    + _SLURM_ERRORS,
+    "VASP": [
+        [pattern, signature, reason]
+        for pattern in ["*.out", "OUTCAR"]
+        for signature, reason in [
+            ["ZBRENT: fatal error", "ZBRENT"],
+            ["Error EDDDAV", "EDDDAV"],
+            ["Error EDDRMM", "EDDRMM"],
+            ["TOO FEW BANDS", "too few bands"],
+        ]
+    ]
+    + _SLURM_ERRORS,
+}
+
+# Files from which the progress of running jobs is estimated, as alternative
+# [filename, parser] pairs. See autojob.progress.
+CONFIG["progress"] = {
+    "FEFF": [["feff.out", "feff"]],
+    "VASP": [["OSZICAR", "oszicar"], ["OUTCAR", "outcar"]],
+}
+
+
+# The part of an output file searched for substrings, unless specified
+# otherwise in the check
+# By default, the trailing 4 KiB of output files are searched first, growing
+# up to 1 MiB until the signatures are found
+DEFAULT_WINDOW = {"adaptive": {"initial": 4096, "max_bytes": 1 << 20}}
+
+# Exceptions raised when output files cannot be read, which are then treated
+# like missing files
+READ_ERRORS = (OSError,) + DECOMPRESSION_ERRORS
+
+
+def search_window(path, matcher, window=DEFAULT_WINDOW, required=None):
+    """Searches part of a file for signatures.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    matcher : autojob.file_utils.SignatureMatcher
+    window : dict, optional
+        Which part of the file to search. Must have exactly one of the keys:
+
+        * "adaptive": a dictionary with the optional keys "initial" (the
+          number of trailing bytes searched first), "max_bytes" (the maximum
+          number of trailing bytes searched, or None for the whole file) and
+          "growth" (the factor by which the number of bytes searched grows
+          until all signatures are found). See
+          :func:`autojob.file_utils.search_tail`.
+        * "lines": the number of trailing lines, read into memory with
+          :func:`autojob.file_utils.tail`.
+        * "bytes": the number of trailing bytes, or None for the whole file,
+          scanned through a memory map.
+        * "range": a [start, end] byte range, where negative values are
+          relative to the end of the file and None means unbounded, scanned
+          through a memory map.
+    required : iterable of str, optional
+        For the "adaptive" window, the signatures which must all be found for
+        the search to stop growing (see
+        :func:`autojob.file_utils.search_reverse_blocks`). Defaults to all of
+        them.
+
+    Returns
+    -------
+    set of str
+        The signatures found.
+    """
+
+    if is_compressed(path):
+        read_tail, scan = tail_compressed, scan_compressed
+        adaptive = search_tail_compressed
+    else:
+        read_tail, scan, adaptive = tail, scan_file, search_tail
 
-def check_computation_type(root, input_files=CONFIG["in"]):
+    if "adaptive" in window:
+        return adaptive(path, matcher, required=required, **window["adaptive"])
+    if "lines" in window:
+        return matcher.search(read_tail(path, n_lines=window["lines"]))
+    if "bytes" in window:
+        n = window["bytes"]
+        return scan(path, matcher, start=None if n is None else -n)
+    if "range" in window:
+        return scan(path, matcher, *window["range"])
+    raise ValueError(f"Unknown window {window}")
+
+
+def find_output_file(root, filename, listing=None, throttle=NULL_THROTTLE):
+    """Finds an output file, or a compressed version of it (e.g. OUTCAR.gz
+    for OUTCAR), in a directory.
+
+    Parameters
+    ----------
+    root : os.PathLike
+    filename : str
+    listing : dict, optional
+        The listing of the directory, if already known. Otherwise the
+        existence of each candidate file is checked on disk.
+    throttle : autojob.throttle.MetadataThrottle, optional
+
+    Returns
+    -------
+    str or None
+        The name of the file found, preferring the uncompressed one, or None
+        if neither exist.
+    """
+
+    candidates = [filename] + [filename + xx for xx in COMPRESSION_SUFFIXES]
+    for candidate in candidates:
+        if listing is not None:
+            if candidate in listing:
+                return candidate
+            continue
+        with throttle.op():
+            if os.path.exists(os.path.join(root, candidate)):
+                return candidate
+    return None
+
+
+def check_computation_type(
+    root, input_files=CONFIG["in"], contained=None, throttle=NULL_THROTTLE
+):
     """Determines which type of computation has been completed in the directory
     of interest. In the cases when no input file types can be matched, or when
     multiple input file types are found, warnings/errors will be logged and
@@ -46,11 +200,18 @@ def check_computation_type(root, input_files=CONFIG["in"]):
     ----------
     root : os.PathLike
         The directory containing the
-    input_files : dict, optional
+    input_files : dict or autojob.detect.CalculationTypeDetector, optional
         A dictionary that contains keys corresponding to computation types
-        (e.g. VASP) and values of lists of file names. These file names must
-        _all_ be present in a given directory to confirm that the calculation
-        is of a certain type.
+        (e.g. VASP) and values of lists of file names (or glob patterns).
+        These file names must _all_ be present in a given directory to
+        confirm that the calculation is of a certain type. The rules are
+        compiled into a :class:`autojob.detect.CalculationTypeDetector` once
+        and reused.
+    contained : iterable of str, optional
+        The names of the files in the directory, if already known (e.g. from
+        the directory search). Otherwise the directory is listed.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        Filesystem calls are made through this throttle.
 
     Returns
     -------
@@ -59,15 +220,14 @@ def check_computation_type(root, input_files=CONFIG["in"]):
         options are found in DEFAULT_INPUT_FILES.
     """
 
-    contained = {xx.parts[-1] for xx in list(Path(root).iterdir())}
-    overlap = {
-        key: set(value).issubset(contained)
-        for key, value in input_files.items()
-    }
+    if contained is None:
+        with throttle.op():
+            contained = {xx.parts[-1] for xx in list(Path(root).iterdir())}
+    matches = get_detector(input_files).matches(contained)
 
     # Check to see if for some reason there are multiple computations' input
     # files in one directory. This obvious is a problem.
-    N = sum(list(overlap.values()))
+    N = len(matches)
     if N != 1:
         if N < 1:
             logger.warning(f"No matching input files found in {root}")
@@ -75,18 +235,179 @@ def check_computation_type(root, input_files=CONFIG["in"]):
             logger.error(f"More than one type of calculation found in {root}")
         return None
 
-    # Otherwise, we simply find which one is true
-    calc_type = [key for key, value in overlap.items() if value][0]
+    calc_type = matches[0]
     logger.debug(f"{root} identified as {calc_type}")
     return calc_type
 
 
-def check_job_status(root, checks):
+def _match_error_files(names, errors):
+    """Gets the names of the files matching any of the error patterns."""
+
+    patterns = {xx[0] for xx in errors}
+    return sorted(
+        name
+        for name in names
+        if any(fnmatchcase(name, pattern) for pattern in patterns)
+    )
+
+
+def diagnose_job(root, checks, errors=(), listing=None, throttle=NULL_THROTTLE):
+    """Checks the status of a job like :func:`check_job_status`, and also
+    determines the reasons it may have failed from a catalogue of known error
+    signatures.
+
+    Error signatures in files which are also read by the completion checks are
+    searched for in the same pass (and window). Files only containing error
+    signatures, such as SLURM error logs, are only read if the job did not
+    complete successfully.
+
+    Parameters
+    ----------
+    root : os.PathLike
+    checks : list of list of str
+        See :func:`check_job_status`.
+    errors : list of list of str, optional
+        A list of [filename pattern, signature, reason] lists. The pattern is
+        a glob matched against the names of the files in the directory, which
+        are searched for the signature. If it is found, the reason is
+        reported. See ``CONFIG["errors"]`` for the defaults.
+    listing : dict, optional
+        See :func:`check_job_status`.
+    throttle : autojob.throttle.MetadataThrottle, optional
+
+    Returns
+    -------
+    tuple
+        True if the job has completed successfully (False otherwise), and the
+        list of the reasons found, in the order of the catalogue.
+    """
+
+    root = Path(root)
+    status = True
+    groups = dict()
+    windows = dict()
+
+    def group(filename, window):
+        return groups.setdefault(
+            (filename, window), {"checks": [], "errors": []}
+        )
+
+    for check in checks:
+        filename, substring = check[:2]
+        window = check[2] if len(check) > 2 else DEFAULT_WINDOW
+        found = find_output_file(root, filename, listing, throttle)
+        if found is None:
+            logger.debug(f"{root / filename} does not exist - status FALSE")
+            status = False
+            break
+        filename = found
+        path = root / Path(filename)
+
+        # Substring checks are gathered so that each file is read only once
+        # (per window)
+        if substring is not None:
+            window = json.dumps(window, sort_keys=True)
+            windows.setdefault(filename, window)
+            group(filename, window)["checks"].append(str(substring))
+            continue
+
+        # Check for existence and that the file size is > 0
+        stats = listing.get(filename) if listing is not None else None
+        try:
+            if is_compressed(path):
+                with throttle.read(), open_decompressed(path) as f:
+                    size = len(f.read(1))
+            elif stats is not None:
+                size = stats[0]
+            else:
+                with throttle.op():
+                    size = path.stat().st_size
+        except READ_ERRORS:
+            logger.debug(f"{path} cannot be read - status FALSE")
+            status = False
+            break
+        if size == 0:
+            logger.debug(f"{path} is empty - status FALSE")
+            status = False
+            break
+
+    if not status and not errors:
+        return status, []
+
+    if errors:
+        if listing is None:
+            with throttle.op():
+                names = os.listdir(root)
+        else:
+            names = listing
+        default = json.dumps(DEFAULT_WINDOW, sort_keys=True)
+        for name in _match_error_files(names, errors):
+            for pattern, signature, reason in errors:
+                if fnmatchcase(name, pattern):
+                    window = windows.get(name, default)
+                    group(name, window)["errors"].append(str(signature))
+
+    # Completion checks come first, so the status is known before deciding
+    # whether to read the files which only contain error signatures
+    found_errors = set()
+    for (filename, window), signatures in groups.items():
+        if status and not signatures["checks"]:
+            continue
+        if not status and not signatures["errors"]:
+            continue
+        path = root / Path(filename)
+        matcher = compile_signatures(
+            tuple(signatures["checks"] + signatures["errors"])
+        )
+
+        # While the job may have completed, the search stops as soon as the
+        # completion checks are satisfied, and the error signatures are only
+        # searched for in the part of the file read until then
+        required = signatures["checks"] if status else None
+        try:
+            with throttle.read():
+                found = search_window(
+                    path, matcher, json.loads(window), required
+                )
+        except READ_ERRORS as err:
+            logger.debug(f"{path} cannot be read ({err})")
+            found = set()
+        missing = [xx for xx in signatures["checks"] if xx not in found]
+        if missing:
+            logger.debug(f"{path} missing {missing} - status FALSE")
+            status = False
+        found_errors.update(
+            (filename, xx) for xx in signatures["errors"] if xx in found
+        )
+
+    reasons = []
+    for pattern, signature, reason in errors:
+        if reason in reasons:
+            continue
+        if any(
+            fnmatchcase(name, pattern) and str(signature) == xx
+            for name, xx in found_errors
+        ):
+            reasons.append(reason)
+
+    if status:
+        logger.debug(f"{root} - status TRUE")
+    elif reasons:
+        logger.debug(f"{root} - failure reasons {reasons}")
+    return status, reasons
+
+
+def check_job_status(root, checks, listing=None, throttle=NULL_THROTTLE):
     """Checks the status of a job by looking in the directory of interest for
     the appropriate completion status. This function does not check that the
     provided root directory actually corresponds to the type of calculation
     provided will error ungracefully if it does not contain the appropriate
-    files. Output files have their last 100 lines checked.
+    files. By default, the end of output files is searched in growing blocks
+    (see ``DEFAULT_WINDOW``), starting with the last 4 KiB. Each file is read
+    once, and all the substrings checked in it are searched for in a single
+    pass.
+    If an output file does not exist but a compressed version of it does (see
+    :func:`find_output_file`), the compressed file is checked instead.
 
     Parameters
     ----------
@@ -95,7 +416,18 @@ def check_job_status(root, checks):
     checks : list of list of str
         A doubly nested list. The outer lists correspond to filename-substring
         pairs. If the substring is None, then this will simply check whether or
-        not the file exists and is not empty.
+        not the file exists and is not empty. A third element may be provided
+        to specify the window of the file searched for the substring (see
+        :func:`search_window`), e.g. ``{"bytes": None}`` to search a whole
+        file through a memory map, or ``{"lines": 100}`` for the last 100
+        lines.
+    listing : dict, optional
+        The listing of the directory recorded by
+        :func:`autojob.file_utils.iter_directory_search`. If provided, the
+        existence of files is determined from it, and so are their sizes if
+        available.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        Filesystem calls are made through this throttle.
 
     Returns
     -------
@@ -103,33 +435,188 @@ def check_job_status(root, checks):
         True if the job has completed successfully, False otherwise.
     """
 
-    for filename, substring in checks:
-        path = Path(root) / Path(filename)
-        logger.debug(f"Running checks {checks} on {path}")
+    return diagnose_job(root, checks, (), listing, throttle)[0]
 
-        # Check for existence and that the file size is > 0
-        if substring is None:
-            if not path.exists():
-                logger.debug(f"{path} does not exist - status FALSE")
-                return False
-            if path.stat().st_size == 0:
-                logger.debug(f"{path} is empty - status FALSE")
-                return False
-        else:
-            command = f"tail -n 100 {str(path)}"
-            res = run_command(command)
-            lines = res["stdout"].split("\n")
-            cond = check_if_substring_match(lines, str(substring))
 
-            if not cond:
-                logger.debug(f"{path} missing {substring} - status FALSE")
-                return False
+def _check_directory(
+    directory,
+    listing,
+    input_files,
+    output_files,
+    errors,
+    throttle,
+    cache,
+    file_stats,
+    progress,
+):
+    """Classifies a single directory and checks its status.
 
-    logger.debug(f"{path} - status TRUE")
-    return True
+    Returns
+    -------
+    dict
+        See :func:`iter_job_statuses`.
+    """
+
+    path = str(directory)
+    ctype = check_computation_type(directory, input_files, listing, throttle)
+    if ctype is None:
+        return {"path": path, "ctype": ctype, "status": "unknown"}
+
+    checks = output_files[ctype]
+    errors = errors.get(ctype, [])
+    extra = dict()
+    if cache is not None or file_stats:
+        filenames = {
+            find_output_file(directory, check[0], listing, throttle)
+            for check in checks
+        }
+        if errors:
+            if listing is None:
+                with throttle.op():
+                    listing = dict.fromkeys(os.listdir(directory))
+            filenames.update(_match_error_files(listing, errors))
+        filenames = sorted(xx for xx in filenames if xx is not None)
+        signature = file_signature(directory, filenames, throttle)
+        if file_stats:
+            extra["files"] = signature
+
+    result = None
+    if cache is not None:
+        config = [checks, errors]
+        result = cache.lookup(path, ctype, config, signature)
+        if result is not None:
+            logger.debug(f"{path} - cached status {result['status']}")
+
+    if result is None:
+        status, reasons = diagnose_job(
+            directory, checks, errors, listing, throttle
+        )
+        result = {"status": "success" if status else "fail", "reasons": reasons}
+        if cache is not None:
+            cache.update(path, ctype, config, signature, result)
+
+    if progress is not None and result["status"] == "fail":
+        sources = CONFIG["progress"].get(ctype, [])
+        extra["progress"] = job_progress(directory, sources, progress, throttle)
+    return dict(path=path, ctype=ctype, **result, **extra)
+
+
+def iter_job_statuses(
+    root,
+    filename,
+    output_files=CONFIG["out"],
+    search_kwargs=None,
+    throttle=None,
+    jobs=1,
+    cache=None,
+    errors=CONFIG["errors"],
+    file_stats=False,
+    progress=None,
+    input_files=CONFIG["in"],
+):
+    """Lazily determines the calculation type and status of every directory
+    found by the directory search. Directories are checked as soon as they are
+    found, while the search continues in the background.
+
+    Parameters
+    ----------
+    root : os.PathLike
+        Root location for the exhaustive directory search.
+    filename : str or list of str
+        Looks exhaustively in root for directories containing a file matching
+        this name (or any of these names).
+    output_files : dict, optional
+        The checks to run for each calculation type. See
+        :func:`check_job_status`.
+    search_kwargs : dict, optional
+        Extra keyword arguments passed to
+        :func:`autojob.file_utils.iter_directory_search`.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        If provided, limits the rate and concurrency of the filesystem calls
+        made by both the directory search and the checks.
+    jobs : int, optional
+        The number of threads used to check directories concurrently. The
+        checks are bound by filesystem latency rather than CPU, so threads
+        are effective even beyond the number of cores.
+    cache : autojob.cache.StatusCache, optional
+        If provided, the statuses of directories whose output files have not
+        changed since they were last checked are taken from the cache, and
+        the cache is updated with the others. It is up to the caller to save
+        it.
+    errors : dict, optional
+        The catalogue of failure signatures for each calculation type. See
+        :func:`diagnose_job`.
+    file_stats : bool, optional
+        If True, the records of identified directories also have a "files"
+        key, with the :func:`autojob.cache.file_signature` of the files
+        checked.
+    progress : autojob.progress.ProgressCache, optional
+        If provided, the records of jobs which did not complete successfully
+        (including those still running) have a "progress" key, with the
+        progress parsed from the files in ``CONFIG["progress"]``, or None if
+        none of them exist. Only the bytes appended to the files since they
+        were last parsed with the same cache are read. It is up to the caller
+        to save it.
+    input_files : dict, optional
+        The rules identifying each calculation type. See
+        :func:`check_computation_type`.
 
+    Yields
+    ------
+    dict
+        A record with the keys "path", "ctype" and "status". The status is one
+        of "success" or "fail", or "unknown" if the calculation type could not
+        be determined, in which case the ctype is None. Identified directories
+        also have a "reasons" key, listing the known failure signatures found.
+    """
 
-def generate_report(root, filename, output_files=CONFIG["out"]):
+    if search_kwargs is None:
+        search_kwargs = dict()
+    if throttle is None:
+        throttle = NULL_THROTTLE
+    else:
+        search_kwargs = dict(search_kwargs, throttle=throttle)
+    search_kwargs = dict(search_kwargs, with_listing=True)
+    directories = iter_directory_search(root, filename, **search_kwargs)
+
+    if cache is not None:
+        cache.begin()
+    if progress is not None:
+        progress.begin()
+
+    detector = get_detector(input_files)
+
+    def check(hit):
+        return _check_directory(
+            *hit,
+            detector,
+            output_files,
+            errors,
+            throttle,
+            cache,
+            file_stats,
+            progress,
+        )
+
+    yield from imap_unordered(check, directories, jobs)
+
+
+def generate_report(
+    root,
+    filename,
+    output_files=CONFIG["out"],
+    search_kwargs=None,
+    throttle=None,
+    jobs=1,
+    cache=None,
+    errors=CONFIG["errors"],
+    store=None,
+    stream=None,
+    keep_paths=True,
+    progress=None,
+    input_files=CONFIG["in"],
+    rollup=None,
+):
     """Generates a report of which jobs have finished, which are still ongoing
     and which have failed. Currently, returns True if the job completed with
     seemingly no issues, and False otherwise.
@@ -151,55 +638,139 @@ def generate_report(root, filename, output_files=CONFIG["out"]):
     ----------
     root : os.PathLike
         Root location for the exhaustive directory search.
-    filename : str
+    filename : str or list of str
         Looks exhaustively in root for directories containing a file matching
-        this name.
-    identifiers : dict, optional
+        this name (or any of these names).
+    output_files : dict, optional
+        The checks to run for each calculation type. See
+        :func:`check_job_status`.
+    search_kwargs : dict, optional
+        Extra keyword arguments passed to
+        :func:`autojob.file_utils.iter_directory_search`.
+    throttle : autojob.throttle.MetadataThrottle, optional
+        If provided, limits the rate and concurrency of the filesystem calls
+        made while generating the report.
+    jobs : int, optional
+        The number of threads used to check directories concurrently. The
+        report does not depend on the number of threads.
+    cache : autojob.cache.StatusCache, optional
+        If provided, only directories whose output files changed since the
+        last report are checked again. It is up to the caller to save it.
+    errors : dict, optional
+        The catalogue of failure signatures for each calculation type. See
+        :func:`diagnose_job`.
+    store : autojob.store.ReportStore, optional
+        If provided, every record (including those of unidentified
+        directories) is also written to the store, along with the statistics
+        of the files checked. Rows of directories under ``root`` which were
+        not found are removed from it once the search completes.
+    stream : autojob.store.JsonlWriter, optional
+        If provided, every record (including those of unidentified
+        directories) is also written to it as soon as it is determined.
+    keep_paths : bool, optional
+        If False, the report only holds the counts of directories and not
+        their paths, so that memory use does not grow with the number of
+        directories. The records are then only available from the store or
+        the stream.
+    progress : autojob.progress.ProgressCache, optional
+        If provided, the progress of the jobs which did not complete
+        successfully is estimated (see :func:`iter_job_statuses`). It is up to
+        the caller to save it.
+    input_files : dict, optional
         A dictionary containing strings as keys, which identify the computation
-        type, and sets as values, which identify input files that all must be
+        type, and lists as values, which identify input files that all must be
         contained in the directory to identify the directory as corresponding
-        to a certain computation type. Default is DEFAULT_INPUT_FILES.
+        to a certain computation type. See :func:`check_computation_type`.
+    rollup : autojob.rollup.Rollup, optional
+        If provided, the records are also counted in every ancestor directory
+        of the jobs.
 
     Returns
     -------
     dict
-        A dictionary with keys as the paths to the directories checked and
-        boolean values, indicating the success status of the calculation.
+        A dictionary keyed by calculation type. Each value is a dictionary
+        with the "counts" of successful and failed directories and the
+        "reason_counts" over all failed directories. Unless ``keep_paths`` is
+        False, it also has the sorted lists of "success" and "fail"
+        directories and the failure "reasons" of each failed directory for
+        which any were found, as well as their "progress" if requested.
     """
 
     logger.info(f"Generating report at {root} (searching for {filename})")
 
-    # Get the directories matching the filename of the directory search
-    directories = exhaustive_directory_search(root, filename)
-
-    # For each directory in the tree, determine the type of calculation that
-    # was run.
-    calculation_types = {dd: check_computation_type(dd) for dd in directories}
-    calculation_types = {
-        key: value
-        for key, value in calculation_types.items()
-        if value is not None
-    }
-    cc = Counter(list(calculation_types.values()))
-
-    # Get the statuses
-    status = dict()
-    complete = {ctype: 0 for ctype in cc.keys()}
-    report = {ctype: {"success": [], "fail": []} for ctype in cc.keys()}
-    for dd, ctype in calculation_types.items():
-        checks = output_files[ctype] if ctype is not None else None
-        status[dd] = check_job_status(dd, checks=checks)
-        complete[ctype] += int(status[dd])
-
-        if status[dd]:
-            report[ctype]["success"].append(str(dd))
-        else:
-            report[ctype]["fail"].append(str(dd))
-
-    for ctype, ncomplete in complete.items():
-        if ncomplete == cc[ctype]:
+    report = dict()
+    records = iter_job_statuses(
+        root,
+        filename,
+        output_files,
+        search_kwargs,
+        throttle,
+        jobs,
+        cache,
+        errors,
+        file_stats=store is not None,
+        progress=progress,
+        input_files=input_files,
+    )
+    # Only the stale rows under this root are removed from the store
+    if store is not None:
+        store.begin(root)
+    for sink in (stream, rollup):
+        if sink is not None:
+            sink.begin()
+    sinks = [xx for xx in (store, stream, rollup) if xx is not None]
+    for record in records:
+        for sink in sinks:
+            sink.add(record)
+        ctype = record["ctype"]
+        if ctype is None:
+            continue
+        if ctype not in report:
+            report[ctype] = {
+                "counts": {"success": 0, "fail": 0},
+                "reason_counts": Counter(),
+            }
+            if keep_paths:
+                report[ctype].update(success=[], fail=[], reasons=dict())
+            if keep_paths and progress is not None:
+                report[ctype]["progress"] = dict()
+        status = record["status"]
+        report[ctype]["counts"][status] += 1
+        if status == "fail":
+            report[ctype]["reason_counts"].update(record["reasons"])
+        if keep_paths:
+            report[ctype][status].append(record["path"])
+            if status == "fail" and record["reasons"]:
+                report[ctype]["reasons"][record["path"]] = record["reasons"]
+            if status == "fail" and progress is not None:
+                report[ctype]["progress"][record["path"]] = record["progress"]
+
+    for sink in sinks:
+        sink.finish()
+
+    # The directories are found in no particular order
+    report = dict(sorted(report.items()))
+    for value in report.values():
+        value["reason_counts"] = dict(
+            sorted(
+                value["reason_counts"].items(), key=lambda xx: (-xx[1], xx[0])
+            )
+        )
+        if keep_paths:
+            value["success"].sort()
+            value["fail"].sort()
+            value["reasons"] = dict(sorted(value["reasons"].items()))
+        if "progress" in value:
+            value["progress"] = dict(sorted(value["progress"].items()))
+
+    for ctype, value in report.items():
+        ncomplete = value["counts"]["success"]
+        total = ncomplete + value["counts"]["fail"]
+        if ncomplete == total:
             logger.success(f"{ctype}: all {ncomplete} complete")
         else:
-            logger.warning(f"{ctype} incomplete: {ncomplete}/{cc[ctype]}")
+            logger.warning(f"{ctype} incomplete: {ncomplete}/{total}")
+        for reason, count in value["reason_counts"].items():
+            logger.warning(f"{ctype} failures due to {reason}: {count}")
 
     return report
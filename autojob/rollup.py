@@ -0,0 +1,161 @@
+"""Aggregation of report records over the directory tree. Campaigns are
+usually organized hierarchically (e.g. ``material/structure/edge/site``), and
+the completion of each level of the hierarchy is of more interest than that
+of individual jobs. The :class:`Rollup` counts the records under every
+ancestor directory of the jobs in a single pass over them."""
+
+import heapq
+import os
+
+
+CATEGORIES = ["success", "fail", "running", "unknown"]
+
+_INDEX = {category: ii for ii, category in enumerate(CATEGORIES)}
+
+
+def categorize(record):
+    """Gets the category of a record. Jobs which did not complete successfully
+    are considered to be running if they have no known failure reasons and
+    their progress could be determined (see
+    :func:`autojob.report.iter_job_statuses`).
+
+    Parameters
+    ----------
+    record : dict
+
+    Returns
+    -------
+    str
+        One of :data:`CATEGORIES`.
+    """
+
+    status = record["status"]
+    if status == "fail" and not record.get("reasons"):
+        if record.get("progress") is not None:
+            return "running"
+    return status
+
+
+class Rollup:
+    """Counts of records of each category (see :data:`CATEGORIES`) for every
+    ancestor directory of the jobs, up to the root of the search. The counts
+    are held in a tree of nested lists, with one node per directory.
+
+    Parameters
+    ----------
+    root : os.PathLike
+        The root of the directory search.
+    """
+
+    def __init__(self, root):
+        self._root = os.fspath(root).rstrip(os.sep)
+        self._tree = self._node()
+
+    @staticmethod
+    def _node():
+        return [[0] * len(CATEGORIES), dict()]
+
+    def _parts(self, path):
+        prefix = self._root + os.sep
+        if path.startswith(prefix):
+            relative = path[len(prefix) :]
+        else:
+            relative = os.path.relpath(path, self._root)
+        return [xx for xx in relative.split(os.sep) if xx not in ("", ".")]
+
+    def begin(self):
+        self._tree = self._node()
+
+    def add(self, record):
+        """Counts a record in all of its ancestor directories.
+
+        Parameters
+        ----------
+        record : dict
+            A record as yielded by :func:`autojob.report.iter_job_statuses`.
+        """
+
+        index = _INDEX[categorize(record)]
+        node = self._tree
+        node[0][index] += 1
+        for part in self._parts(record["path"])[:-1]:
+            children = node[1]
+            node = children.get(part)
+            if node is None:
+                node = children[part] = self._node()
+            node[0][index] += 1
+
+    def finish(self):
+        pass
+
+    def iter_nodes(self, depth=None):
+        """Iterates over the directories.
+
+        Parameters
+        ----------
+        depth : int, optional
+            If provided, only directories at this depth below the root (the
+            root being at depth 0).
+
+        Yields
+        ------
+        tuple
+            The path of each directory relative to the root, and its counts
+            as a dictionary keyed by category.
+        """
+
+        stack = [((), self._tree)]
+        while stack:
+            parts, (counts, children) = stack.pop()
+            if depth is None or len(parts) == depth:
+                path = os.path.join(*parts) if parts else "."
+                yield path, dict(zip(CATEGORIES, counts))
+            if depth is not None and len(parts) >= depth:
+                continue
+            for name in sorted(children, reverse=True):
+                stack.append((parts + (name,), children[name]))
+
+    def least_complete(self, k, depth=None):
+        """Gets the directories with the lowest fraction of successful jobs.
+
+        Parameters
+        ----------
+        k : int
+        depth : int, optional
+            See :meth:`iter_nodes`.
+
+        Returns
+        -------
+        list of tuple
+            The path, the fraction of successful jobs and the counts of the
+            (at most) ``k`` least complete directories containing any jobs,
+            least complete first. Ties are broken in favor of directories
+            with more jobs.
+        """
+
+        def key(item):
+            counts = item[1]
+            total = sum(counts[xx] for xx in ["success", "fail", "running"])
+            return counts["success"] / total, -total
+
+        nodes = (
+            item
+            for item in self.iter_nodes(depth)
+            if item[1]["success"] + item[1]["fail"] + item[1]["running"]
+        )
+        return [
+            (path, key((path, counts))[0], counts)
+            for path, counts in heapq.nsmallest(k, nodes, key=key)
+        ]
+
+    def to_dict(self):
+        """Gets the tree as a json-serializable dictionary. Each node is a
+        list of the counts (in the order of the categories) and a dictionary
+        of the child nodes keyed by directory name.
+
+        Returns
+        -------
+        dict
+        """
+
+        return {"categories": CATEGORIES, "tree": self._tree}
@@ -0,0 +1,337 @@
+"""Execution of tethered calculations by autojob itself rather than by bash.
+
+With a work queue, every staged job runs a worker (``aj work``) which
+repeatedly claims the next calculation from a :class:`WorkQueue` shared by all
+staged jobs, until the queue is empty. Staged jobs on fast nodes (or which
+start early) therefore run more calculations, and calculations not yet
+claimed by a staged job which crashed are run by the others. The queue is a
+directory of plain files on the shared filesystem, protected by a POSIX lock
+(``fcntl.lockf``), which unlike ``flock`` is also honored across nodes on NFS.
+
+With a chunk, every staged job runs a fixed list of calculations
+(``aj run-chunk``) through a pool of slots.
+
+Either way, the exit code, wall time, CPU time and peak memory of every
+calculation are recorded (see :func:`run_calculation`), and can be used to
+estimate the runtimes of later calculations (see
+:func:`autojob.tether.get_cost_function`)."""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+from pathlib import Path
+import socket
+import subprocess
+from threading import Lock, Thread
+from time import monotonic, time
+
+from autojob import logger
+from autojob.file_utils import imap_unordered, read_json, save_json
+
+
+def _exit_code(status):
+    """Converts a wait status into a return code like those of
+    :class:`subprocess.Popen`."""
+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_calculation(path, executable):
+    """Runs a calculation and measures the resources it used.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The directory the executable is run in.
+    executable : str
+        A shell command.
+
+    Returns
+    -------
+    dict
+        A record with the "path", the "host", the "returncode", the
+        "started_at" time and the "elapsed" wall time, the "user" and
+        "system" CPU times in seconds, and the peak resident memory "maxrss"
+        in KiB (the largest of the process and its descendants). If the
+        command could not be started, the return code and the resource usage
+        are None.
+    """
+
+    record = {
+        "path": os.fspath(path),
+        "host": socket.gethostname(),
+        "started_at": time(),
+    }
+    t0 = monotonic()
+    try:
+        proc = subprocess.Popen(executable, shell=True, cwd=path)
+    except OSError as err:
+        logger.error(f"Could not run {path}: {err}")
+        return dict(
+            record,
+            returncode=None,
+            elapsed=0.0,
+            user=None,
+            system=None,
+            maxrss=None,
+        )
+
+    # Reaped with wait4 rather than by Popen to get the resource usage of
+    # this child alone, which matters when several run at the same time
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = _exit_code(status)
+    record.update(
+        returncode=proc.returncode,
+        elapsed=monotonic() - t0,
+        user=usage.ru_utime,
+        system=usage.ru_stime,
+        maxrss=usage.ru_maxrss,
+    )
+    if proc.returncode != 0:
+        logger.warning(f"{path} exited with {proc.returncode}")
+    return record
+
+
+class WorkQueue:
+    """A queue of calculation directories shared by several processes. The
+    directories are listed once in a file, and claiming one only advances a
+    byte offset stored in another file, so that claims cost the same however
+    long the queue is.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+        The directory holding the queue files, created by :meth:`create`.
+    """
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def executable(self):
+        """The command run in each calculation directory."""
+
+        return self._config["executable"]
+
+    def __init__(self, directory):
+        self._directory = Path(directory)
+        self._config = read_json(self._directory / Path("config.json"))
+
+        # POSIX locks are held per process, so threads of the same worker are
+        # excluded from each other separately
+        self._thread_lock = Lock()
+
+    @classmethod
+    def create(cls, directory, paths, executable):
+        """Creates a queue.
+
+        Parameters
+        ----------
+        directory : os.PathLike
+            Must not exist.
+        paths : iterable of os.PathLike
+            The calculation directories, in the order they are claimed.
+        executable : str
+            The command run in each calculation directory.
+
+        Returns
+        -------
+        WorkQueue
+        """
+
+        directory = Path(directory)
+        directory.mkdir(exist_ok=False, parents=True)
+        n = 0
+        with open(directory / Path("tasks"), "w") as f:
+            for path in paths:
+                f.write(f"{os.path.abspath(path)}\n")
+                n += 1
+        (directory / Path("cursor")).write_text("0")
+        (directory / Path("lock")).touch()
+        config = {"executable": executable, "size": n}
+        save_json(config, directory / Path("config.json"))
+        return cls(directory)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self._directory / Path("lock"), "r+") as lock:
+                fcntl.lockf(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def _log(self, name, record):
+        """Appends a record to a log file. Must be called with the lock."""
+
+        with open(self._directory / Path(name), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def claim(self):
+        """Claims the next calculation directory.
+
+        Returns
+        -------
+        str or None
+            The directory, or None if the queue is empty.
+        """
+
+        with self._locked():
+            cursor_path = self._directory / Path("cursor")
+            offset = int(cursor_path.read_text())
+            with open(self._directory / Path("tasks"), "rb") as f:
+                f.seek(offset)
+                line = f.readline()
+            if not line:
+                return None
+            # Replaced rather than overwritten, so that it is never seen empty
+            temporary = cursor_path.with_suffix(".tmp")
+            temporary.write_text(str(offset + len(line)))
+            os.replace(temporary, cursor_path)
+            path = line.decode().rstrip("\n")
+            self._log(
+                "claims.jsonl",
+                {
+                    "path": path,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "claimed_at": time(),
+                },
+            )
+        return path
+
+    def complete(self, record):
+        """Records that a calculation finished running.
+
+        Parameters
+        ----------
+        record : dict
+            As returned by :func:`run_calculation`.
+        """
+
+        with self._locked():
+            self._log("done.jsonl", record)
+
+    def remaining(self):
+        """The number of calculations not claimed yet."""
+
+        with self._locked():
+            offset = int((self._directory / Path("cursor")).read_text())
+            with open(self._directory / Path("tasks"), "rb") as f:
+                f.seek(offset)
+                return sum(1 for _ in f)
+
+
+def _work(queue):
+    """Runs calculations from a queue until it is empty.
+
+    Returns
+    -------
+    int
+        The number of calculations run.
+    """
+
+    n = 0
+    while True:
+        path = queue.claim()
+        if path is None:
+            return n
+        logger.info(f"Running {path}")
+        queue.complete(run_calculation(path, queue.executable))
+        n += 1
+
+
+def run_worker(directory, slots=1):
+    """Runs calculations from a queue until it is empty.
+
+    Parameters
+    ----------
+    directory : os.PathLike
+        The directory of the :class:`WorkQueue`.
+    slots : int, optional
+        The number of calculations run at the same time.
+
+    Returns
+    -------
+    int
+        The number of calculations run.
+    """
+
+    queue = WorkQueue(directory)
+    counts = [0] * slots
+
+    def target(ii):
+        counts[ii] = _work(queue)
+
+    threads = [Thread(target=target, args=(ii,)) for ii in range(slots)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info(f"Worker ran {sum(counts)} calculations, queue is empty")
+    return sum(counts)
+
+
+def write_chunk(path, directories, executable):
+    """Writes the description of a chunk of calculations run by
+    :func:`run_chunk`.
+
+    Parameters
+    ----------
+    path : os.PathLike
+    directories : list of os.PathLike
+    executable : str
+    """
+
+    chunk = {
+        "executable": executable,
+        "directories": [os.path.abspath(dd) for dd in directories],
+    }
+    save_json(chunk, path)
+
+
+def run_chunk(path, slots=None, manifest=None):
+    """Runs a chunk of calculations, at most ``slots`` at a time, and appends
+    the record of each (see :func:`run_calculation`) to a manifest as soon as
+    it finishes.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The chunk written by :func:`write_chunk`.
+    slots : int, optional
+        Defaults to running all the calculations at once.
+    manifest : os.PathLike, optional
+        Defaults to "manifest.jsonl" next to the chunk.
+
+    Returns
+    -------
+    list of dict
+        The records, in the order the calculations finished.
+    """
+
+    chunk = read_json(path)
+    directories = chunk["directories"]
+    if manifest is None:
+        manifest = Path(path).parent / Path("manifest.jsonl")
+    if slots is None:
+        slots = max(len(directories), 1)
+
+    def run(directory):
+        logger.info(f"Running {directory}")
+        return run_calculation(directory, chunk["executable"])
+
+    records = []
+    with open(manifest, "a") as f:
+        for record in imap_unordered(run, directories, slots):
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            records.append(record)
+    failed = sum(record["returncode"] != 0 for record in records)
+    logger.info(f"Ran {len(records)} calculations ({failed} failed)")
+    return records
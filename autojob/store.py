@@ -0,0 +1,352 @@
+"""Destinations for report records other than the report dictionary. The
+report returned by :func:`autojob.report.generate_report` holds every path in
+memory, and so does its json dump, which must be loaded in its entirety to
+answer any question about it. The :class:`ReportStore` instead keeps one row
+per directory in an indexed SQLite table, so that e.g. the failed VASP jobs
+under some directory can be listed without reading the rest of the report.
+The :class:`JsonlWriter` writes one json line per directory as soon as it is
+checked, so that the report can be followed while it runs."""
+
+import json
+import os
+import sqlite3
+from time import monotonic, time
+
+from autojob import logger
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    ctype TEXT,
+    status TEXT NOT NULL,
+    reasons TEXT,
+    checked_at REAL NOT NULL,
+    files TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, ctype);
+CREATE INDEX IF NOT EXISTS jobs_ctype ON jobs (ctype, status);
+CREATE TABLE IF NOT EXISTS reasons (
+    path TEXT NOT NULL,
+    reason TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reasons_reason ON reasons (reason, path);
+CREATE INDEX IF NOT EXISTS reasons_path ON reasons (path);
+"""
+
+
+def _under(directory):
+    """Gets the SQL condition and parameters selecting the paths in (and
+    including) a directory. Comparing strings is done with the index on the
+    paths, while ``LIKE`` would scan the whole table. ``"0"`` is the character
+    following the path separator. Like the stored paths, the directory is made
+    absolute."""
+
+    directory = os.path.abspath(directory)
+    prefix = directory if directory.endswith(os.sep) else directory + os.sep
+    return (
+        "(path = ? OR (path >= ? AND path < ?))",
+        [directory, prefix, prefix[:-1] + chr(ord(os.sep) + 1)],
+    )
+
+
+class ReportStore:
+    """Per-directory job statuses saved in an SQLite database. Records are
+    buffered and written in bulk, one transaction per batch.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The database file. It is created if it does not exist.
+    batch_size : int, optional
+        The number of records written per transaction.
+    wal : bool, optional
+        If True, the database uses write ahead logging, which allows queries
+        while a report is being written. It requires shared memory between
+        the processes using the database, and so does not work on network
+        filesystems (e.g. Lustre or NFS). Otherwise, the database uses the
+        default rollback journal.
+    """
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, path, batch_size=10000, wal=False):
+        self._path = path
+        self._batch_size = batch_size
+        self._buffer = []
+        self._started = None
+        self._root = None
+        self._connection = sqlite3.connect(os.fspath(path))
+
+        if wal:
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        cursor = self._connection.execute("SELECT COUNT(*) FROM jobs")
+        return cursor.fetchone()[0]
+
+    def begin(self, root=None):
+        """Marks the start of a new report. See :meth:`finish`.
+
+        Parameters
+        ----------
+        root : os.PathLike, optional
+            The root of the directory search of the report. Only rows under
+            it are removed by :meth:`finish`, so that reports of several
+            roots can share a store. If None, all the rows may be removed.
+        """
+
+        self._started = time()
+        self._root = root
+
+    def add(self, record):
+        """Adds (or replaces) the row of a directory. Paths are stored as
+        absolute paths, so that reports of the same directories with
+        differently spelled roots share their rows.
+
+        Parameters
+        ----------
+        record : dict
+            A record as yielded by :func:`autojob.report.iter_job_statuses`.
+        """
+
+        files = record.get("files")
+        self._buffer.append(
+            (
+                os.path.abspath(record["path"]),
+                record["ctype"],
+                record["status"],
+                record.get("reasons", []),
+                time(),
+                json.dumps(files) if files is not None else None,
+            )
+        )
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records."""
+
+        if not self._buffer:
+            return
+        rows = self._buffer
+        self._buffer = []
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM reasons WHERE path = ?", [row[:1] for row in rows]
+            )
+            self._connection.executemany(
+                "INSERT INTO reasons (path, reason) VALUES (?, ?)",
+                [(row[0], reason) for row in rows for reason in row[3]],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)",
+                [row[:3] + (json.dumps(row[3]),) + row[4:] for row in rows],
+            )
+        logger.debug(f"Wrote {len(rows)} records to {self._path}")
+
+    def finish(self):
+        """Writes the buffered records, and removes the rows of directories
+        (under the root of the report) which were not added since
+        :meth:`begin`, i.e. which were not found by the latest report."""
+
+        self.flush()
+        if self._started is None:
+            return
+        condition, parameters = "checked_at < ?", [self._started]
+        if self._root is not None:
+            under, under_parameters = _under(self._root)
+            condition = f"{condition} AND {under}"
+            parameters += under_parameters
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM reasons WHERE path IN "
+                f"(SELECT path FROM jobs WHERE {condition})",
+                parameters,
+            )
+            cursor = self._connection.execute(
+                f"DELETE FROM jobs WHERE {condition}", parameters
+            )
+        if cursor.rowcount:
+            logger.debug(f"Removed {cursor.rowcount} stale records")
+        self._started = None
+
+    def close(self):
+        """Writes the buffered records and closes the database."""
+
+        self.flush()
+        self._connection.close()
+
+    def _where(self, status=None, ctype=None, under=None, reason=None):
+        conditions = []
+        parameters = []
+        if status is not None:
+            conditions.append("status = ?")
+            parameters.append(status)
+        if ctype is not None:
+            conditions.append("ctype = ?")
+            parameters.append(ctype)
+        if under is not None:
+            condition, values = _under(under)
+            conditions.append(condition)
+            parameters.extend(values)
+        if reason is not None:
+            conditions.append(
+                "path IN (SELECT path FROM reasons WHERE reason = ?)"
+            )
+            parameters.append(reason)
+        if not conditions:
+            return "", parameters
+        return " WHERE " + " AND ".join(conditions), parameters
+
+    def query(
+        self, status=None, ctype=None, under=None, reason=None, limit=None
+    ):
+        """Lazily gets the rows matching all of the given filters, ordered by
+        path.
+
+        Parameters
+        ----------
+        status : str, optional
+            One of "success", "fail" or "unknown".
+        ctype : str, optional
+        under : os.PathLike, optional
+            Only rows of this directory and the directories below it.
+        reason : str, optional
+            Only rows of failures with this reason.
+        limit : int, optional
+
+        Yields
+        ------
+        dict
+            The row, as a record like those yielded by
+            :func:`autojob.report.iter_job_statuses`, with the time it was
+            checked under "checked_at".
+        """
+
+        where, parameters = self._where(status, ctype, under, reason)
+        sql = "SELECT * FROM jobs" + where + " ORDER BY path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        for row in self._connection.execute(sql, parameters):
+            path, ctype, status, reasons, checked_at, files = row
+            yield {
+                "path": path,
+                "ctype": ctype,
+                "status": status,
+                "reasons": json.loads(reasons),
+                "checked_at": checked_at,
+                "files": json.loads(files) if files is not None else None,
+            }
+
+    def counts(self, status=None, ctype=None, under=None, reason=None):
+        """Counts the rows matching all of the given filters.
+
+        Parameters
+        ----------
+        status, ctype, under, reason : optional
+            See :meth:`query`.
+
+        Returns
+        -------
+        dict
+            The number of rows for each (ctype, status) pair.
+        """
+
+        where, parameters = self._where(status, ctype, under, reason)
+        sql = (
+            "SELECT ctype, status, COUNT(*) FROM jobs"
+            + where
+            + " GROUP BY ctype, status"
+        )
+        return {
+            (ctype, status): count
+            for ctype, status, count in self._connection.execute(
+                sql, parameters
+            )
+        }
+
+
+class JsonlWriter:
+    """Writes report records to a file as they come in, one json object per
+    line. Writes are flushed at most every ``flush_interval`` seconds, so that
+    the file can be followed (e.g. with ``tail -f``) while the report runs
+    without flushing after every record.
+
+    Parameters
+    ----------
+    path : os.PathLike
+        The file written. It is overwritten if it exists.
+    flush_interval : float, optional
+    """
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, path, flush_interval=1.0):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._file = open(path, "w")
+        self._last_flush = monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def begin(self):
+        pass
+
+    def add(self, record):
+        """Writes a record.
+
+        Parameters
+        ----------
+        record : dict
+            A record as yielded by :func:`autojob.report.iter_job_statuses`.
+        """
+
+        self._file.write(json.dumps(record) + "\n")
+        now = monotonic()
+        if now - self._last_flush >= self._flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def finish(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_jsonl(path):
+    """Lazily reads the records written by a :class:`JsonlWriter`. A partially
+    written last line (e.g. of a report which is still running) is skipped.
+
+    Parameters
+    ----------
+    path : os.PathLike
+
+    Yields
+    ------
+    dict
+    """
+
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                return
+            yield json.loads(line)
@@ -4,13 +4,24 @@ to submit, but each job is cheap and does not require significant
 parallelization. Perhaps each job is even faster than a minute (the minimum
 cronjob time)."""
 
+from collections import Counter
 from copy import copy
-from math import floor, log10
+import getpass
+from heapq import heappop, heappush
+from importlib import import_module
+from itertools import islice
+from math import ceil, floor, log10
+import os
 from pathlib import Path
+import re
+from statistics import median
 import sys
 
 from autojob import logger
-from autojob.file_utils import exhaustive_directory_search
+from autojob.file_utils import iter_directory_search, read_json, run_command
+from autojob.report import CONFIG, iter_job_statuses
+from autojob.runner import WorkQueue, write_chunk
+from autojob.store import read_jsonl
 
 
 def chunks(lst, n):
@@ -19,19 +30,303 @@ def chunks(lst, n):
 
     Parameters
     ----------
-    lst : TYPE
-        Description
-    n : TYPE
-        Description
+    lst : iterable
+        The items to split. May be a lazy iterator, in which case each chunk
+        is yielded as soon as it is filled.
+    n : int
+        The maximum number of items per chunk.
 
     Yields
     ------
-    TYPE
-        Description
+    list
     """
 
-    for ii in range(0, len(lst), n):
-        yield lst[ii : ii + n]
+    it = iter(lst)
+    chunk = list(islice(it, n))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, n))
+
+
+# The directories changed into by the scripts written by the tether constructor
+_CD_LINE = re.compile(r'^\(?cd "?([^"&]+?)"?(?: &&.*)?$')
+
+
+def get_queued_directories(user=None):
+    """Gets the directories of the calculations currently in the SLURM queue
+    (pending or running). These are the working directories of the jobs, and
+    for jobs written by :func:`tether_constructor` (in any mode), the
+    directories of the calculations they run.
+
+    Parameters
+    ----------
+    user : str, optional
+        Defaults to the current user.
+
+    Returns
+    -------
+    set of str
+        Absolute paths. Empty if the queue could not be read.
+    """
+
+    if user is None:
+        user = getpass.getuser()
+    res = run_command(f"squeue -h -u {user} -o %Z")
+    if res["exitcode"] != 0:
+        logger.warning(f"Could not read the SLURM queue: {res['stderr']}")
+        return set()
+
+    queued = set()
+    for workdir in res["stdout"].splitlines():
+        workdir = os.path.abspath(workdir.strip())
+        queued.add(workdir)
+        script = os.path.join(workdir, "submit.sbatch")
+        if os.path.isfile(script):
+            with open(script) as f:
+                for line in f:
+                    match = _CD_LINE.match(line.strip())
+                    if match is not None:
+                        queued.add(os.path.abspath(match.group(1)))
+        chunk = os.path.join(workdir, "chunk.json")
+        if os.path.isfile(chunk):
+            queued.update(read_json(chunk)["directories"])
+        tasks = os.path.join(os.path.dirname(workdir), "queue", "tasks")
+        if os.path.isfile(tasks):
+            with open(tasks) as f:
+                queued.update(line.rstrip("\n") for line in f)
+    return queued
+
+
+def _skip_directories(records, queued, skipped):
+    """Filters the records of directories, counting those skipped."""
+
+    for record in records:
+        if record["status"] == "success":
+            skipped["completed"] += 1
+            continue
+        if queued is not None and os.path.abspath(record["path"]) in queued:
+            skipped["queued"] += 1
+            continue
+        yield Path(record["path"])
+
+
+def uniform_cost(directory):
+    """Every calculation is assumed to take the same time."""
+
+    return 1.0
+
+
+def input_size_cost(directory):
+    """Estimates the cost of a calculation by the total size of the files in
+    its directory, or None if it cannot be read (e.g. it was removed)."""
+
+    try:
+        with os.scandir(directory) as it:
+            return float(
+                sum(
+                    entry.stat().st_size
+                    for entry in it
+                    if entry.is_file(follow_symlinks=False)
+                )
+            )
+    except OSError as err:
+        logger.warning(f"Could not estimate the cost of {directory}: {err}")
+        return None
+
+
+def read_runtimes(paths):
+    """Reads the measured runtimes of calculations.
+
+    Parameters
+    ----------
+    paths : os.PathLike or list of os.PathLike
+        Json files of runtimes keyed by directory, or the manifests of chunks
+        (see :func:`autojob.runner.run_chunk`) and the "done.jsonl" files of
+        work queues (see :class:`autojob.runner.WorkQueue`). Only the
+        calculations which succeeded are read from the latter, and later
+        records replace earlier ones.
+
+    Returns
+    -------
+    dict
+        The runtimes in seconds, keyed by directory.
+    """
+
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    runtimes = dict()
+    for path in paths:
+        if Path(path).suffix != ".jsonl":
+            runtimes.update(read_json(path))
+            continue
+        for record in read_jsonl(path):
+            if record.get("returncode") == 0:
+                runtimes[record["path"]] = record["elapsed"]
+    return runtimes
+
+
+def get_cost_function(cost=None, runtimes=None):
+    """Constructs the function estimating the runtime of a calculation from
+    its directory.
+
+    Parameters
+    ----------
+    cost : callable or str, optional
+        A function of the directory, "size" for :func:`input_size_cost`, or a
+        reference to a function as "package.module:function". Defaults to
+        :func:`uniform_cost`.
+    runtimes : dict or os.PathLike or list of os.PathLike, optional
+        The measured runtimes of calculations from past runs, keyed by
+        directory, or the files containing them (see :func:`read_runtimes`).
+        Directories with a known runtime use it. Others use ``cost`` if
+        provided, and the median of the known runtimes otherwise.
+
+    Returns
+    -------
+    callable
+    """
+
+    if cost is None:
+        function = uniform_cost
+    elif callable(cost):
+        function = cost
+    elif cost == "size":
+        function = input_size_cost
+    else:
+        module, _, name = cost.partition(":")
+        function = getattr(import_module(module), name)
+
+    if runtimes is None:
+        return function
+    if not isinstance(runtimes, dict):
+        runtimes = read_runtimes(runtimes)
+    known = {
+        os.path.abspath(key): float(value) for key, value in runtimes.items()
+    }
+    if cost is None and known:
+        default = median(known.values())
+
+        def function(directory):
+            return default
+
+    def history_cost(directory):
+        value = known.get(os.path.abspath(directory))
+        return value if value is not None else function(directory)
+
+    return history_cost
+
+
+def lpt_pack(costs, n_bins, capacity=None):
+    """Distributes items into bins with the longest processing time first
+    heuristic: items are taken in order of decreasing cost, and each is put
+    in the bin with the least total cost so far. The largest total cost is
+    within 4/3 of the optimum.
+
+    Parameters
+    ----------
+    costs : list of float
+    n_bins : int
+    capacity : int, optional
+        The maximum number of items per bin. Full bins are not considered.
+
+    Returns
+    -------
+    list of list of int
+        The indices of the items in each bin.
+    """
+
+    order = sorted(range(len(costs)), key=lambda ii: -costs[ii])
+    bins = [[] for _ in range(n_bins)]
+    heap = [(0.0, ii) for ii in range(n_bins)]
+    for index in order:
+        load, ii = heappop(heap)
+        bins[ii].append(index)
+        if capacity is None or len(bins[ii]) < capacity:
+            heappush(heap, (load + costs[index], ii))
+    return bins
+
+
+def pack(directories, calculations_per_staged_job, packing="order", cost=None):
+    """Groups calculations into staged jobs.
+
+    Parameters
+    ----------
+    directories : iterable of os.PathLike
+    calculations_per_staged_job : int
+    packing : {"order", "lpt", "sorted"}, optional
+        * "order": in the order the directories are found, without estimating
+          their costs.
+        * "lpt": balances the total estimated cost of the staged jobs (see
+          :func:`lpt_pack`), for staged jobs which run their calculations
+          through fewer slots than calculations.
+        * "sorted": calculations of similar estimated costs are grouped
+          together, which minimizes the time cores sit idle in staged jobs
+          which run all of their calculations at once.
+    cost : callable, optional
+        Estimates the cost of a calculation from its directory. See
+        :func:`get_cost_function`. Calculations whose cost is None are given
+        the median of the other costs.
+
+    Returns
+    -------
+    tuple
+        The list of the chunks of directories, and the list of the lists of
+        their estimated costs (None for the "order" packing).
+    """
+
+    if packing == "order":
+        return list(chunks(directories, calculations_per_staged_job)), None
+
+    directories = list(directories)
+    if cost is None:
+        cost = uniform_cost
+    costs = [cost(dd) for dd in directories]
+    known = [xx for xx in costs if xx is not None]
+    if len(known) < len(costs):
+        default = median(known) if known else uniform_cost(None)
+        costs = [default if xx is None else xx for xx in costs]
+    if packing == "lpt":
+        n_bins = ceil(len(directories) / calculations_per_staged_job)
+        bins = lpt_pack(costs, n_bins, calculations_per_staged_job)
+    elif packing == "sorted":
+        order = sorted(range(len(costs)), key=lambda ii: -costs[ii])
+        bins = list(chunks(order, calculations_per_staged_job))
+    else:
+        raise ValueError(f"Unknown packing {packing}")
+    return (
+        [[directories[ii] for ii in indices] for indices in bins],
+        [[costs[ii] for ii in indices] for indices in bins],
+    )
+
+
+def load_imbalance(costs):
+    """Summarizes the predicted load of staged jobs.
+
+    Parameters
+    ----------
+    costs : list of list of float
+        The estimated costs of the calculations of each staged job.
+
+    Returns
+    -------
+    dict
+        The largest and mean total cost of the staged jobs, the imbalance (the
+        largest over the mean, minus 1), and the fraction of the reserved
+        core time predicted to be idle if every staged job runs all its
+        calculations at once (each on their own cores).
+    """
+
+    totals = [sum(xx) for xx in costs if xx]
+    if not totals:
+        return {"max": 0.0, "mean": 0.0, "imbalance": 0.0, "idle": 0.0}
+    mean = sum(totals) / len(totals)
+    reserved = sum(max(xx) * len(xx) for xx in costs if xx)
+    return {
+        "max": max(totals),
+        "mean": mean,
+        "imbalance": max(totals) / mean - 1.0 if mean > 0 else 0.0,
+        "idle": 1.0 - sum(totals) / reserved if reserved > 0 else 0.0,
+    }
 
 
 def get_file_lines(slurm_header_lines, chunk, executable_line):
@@ -44,6 +339,48 @@ def get_file_lines(slurm_header_lines, chunk, executable_line):
     return file_lines
 
 
+def get_slot_lines(slurm_header_lines, chunk, executable_line, slots):
+    """Like :func:`get_file_lines`, but the script runs at most ``slots``
+    calculations at a time, starting the next one as soon as one finishes
+    (``wait -n`` requires bash 4.3)."""
+
+    executable = executable_line.rstrip().rstrip("&").rstrip()
+    file_lines = copy(slurm_header_lines) + [""]
+    file_lines.append(f"SLOTS={slots}")
+    file_lines.append("wait_for_slot() {")
+    file_lines.append('    while [ "$(jobs -rp | wc -l)" -ge "$SLOTS" ]; do')
+    file_lines.append("        wait -n")
+    file_lines.append("    done")
+    file_lines.append("}")
+    file_lines.append("")
+    for dd in chunk:
+        file_lines.append("wait_for_slot")
+        file_lines.append(f'(cd "{dd.absolute()}" && {executable}) &')
+    file_lines.append("\nwait\nexit")
+    return file_lines
+
+
+def get_worker_lines(slurm_header_lines, queue_directory, slots):
+    """Gets the lines of a script running a worker of a work queue."""
+
+    file_lines = copy(slurm_header_lines) + [""]
+    queue_directory = Path(queue_directory).absolute()
+    file_lines.append(f"aj work {queue_directory} --slots {slots}")
+    file_lines.append("\nexit")
+    return file_lines
+
+
+def get_chunk_lines(slurm_header_lines, chunk_path, slots):
+    """Gets the lines of a script running a chunk of calculations."""
+
+    file_lines = copy(slurm_header_lines) + [""]
+    file_lines.append(
+        f"aj run-chunk {Path(chunk_path).absolute()} --slots {slots}"
+    )
+    file_lines.append("\nexit")
+    return file_lines
+
+
 def tether_constructor(
     root,
     filename,
@@ -51,6 +388,16 @@ def tether_constructor(
     calculations_per_staged_job,
     slurm_header_lines,
     executable_line,
+    search_kwargs=None,
+    packing="order",
+    cost=None,
+    mode="bash",
+    slots=None,
+    skip_completed=False,
+    skip_queued=False,
+    jobs=1,
+    input_files=CONFIG["in"],
+    output_files=CONFIG["out"],
 ):
     """The tether constructor. Writes composite SLURM jobs.
 
@@ -59,22 +406,72 @@ def tether_constructor(
     root : os.PathLike
         The path (absolute or relative) to the directory from which to conduct
         the exhaustive search.
-    filename : str
+    filename : str or list of str
         The exact name of the file which identifies a directory as one of
-        interest.
+        interest. If a list, directories containing any of the files are
+        identified.
     staging_directory : os.PathLike
         The directory to place the submit scripts.
     calculations_per_staged_job : int
-        The number of calculations per composite staged job. Usually this
-        should be more or less equal to the number of cores on a node.
+        The number of calculations per composite staged job. Unless
+        ``slots`` is provided, they all run at the same time, so this should
+        be more or less equal to the number of cores on a node.
     slurm_header_lines : list of str
         The lines for the SLURM job header.
     executable_line : str
         The executable line. Should end in a & such that multiple jobs can
         be run in parallel.
+    search_kwargs : dict, optional
+        Extra keyword arguments passed to
+        :func:`autojob.file_utils.iter_directory_search`.
+    packing : {"order", "lpt", "sorted"}, optional
+        How calculations are grouped into staged jobs. See :func:`pack`.
+    cost : callable, optional
+        Estimates the runtime of a calculation from its directory, for the
+        packings other than "order". See :func:`get_cost_function`.
+    mode : {"bash", "queue"}, optional
+        * "bash": each staged job runs a fixed list of calculations, decided
+          when the scripts are written.
+        * "queue": the calculations are written to a
+          :class:`autojob.runner.WorkQueue` in the "queue" subdirectory of
+          the staging directory, and each staged job runs a worker which
+          claims calculations from it (running up to
+          ``calculations_per_staged_job`` at once) until it is empty. The
+          number of staged jobs is the same as in "bash" mode. Calculations
+          are queued in order of decreasing estimated cost unless ``packing``
+          is "order".
+        * "chunk": like "bash", but the calculations of each staged job are
+          written to a "chunk.json" file next to its script and run by
+          autojob (see :func:`autojob.runner.run_chunk`), which records the
+          exit code, runtime, CPU time and peak memory of each in a
+          "manifest.jsonl" file. The manifests can be given as the
+          ``runtimes`` of :func:`get_cost_function` for later packings.
+    slots : int, optional
+        If provided, each staged job runs at most this many calculations at
+        the same time, starting the next one as soon as one finishes, so
+        that many more calculations than cores can be run by one staged job.
+        In "queue" and "chunk" modes, this otherwise is
+        ``calculations_per_staged_job``.
+    skip_completed : bool, optional
+        If True, calculations which already completed successfully (as
+        determined by :func:`autojob.report.iter_job_statuses`) are not
+        tethered.
+    skip_queued : bool, optional
+        If True, calculations which are currently in the SLURM queue (see
+        :func:`get_queued_directories`) are not tethered.
+    jobs : int, optional
+        The number of threads used to check whether calculations completed.
+    input_files, output_files : dict, optional
+        The identification of the calculation types and their completion
+        checks, used with ``skip_completed``. See
+        :func:`autojob.report.iter_job_statuses`.
     """
 
-    if "&" not in executable_line[-2:]:
+    if mode not in ("bash", "queue", "chunk"):
+        raise ValueError(f"Unknown tether mode {mode}")
+    if slots is not None and slots < 1:
+        raise ValueError(f"slots must be at least 1, got {slots}")
+    if mode == "bash" and slots is None and "&" not in executable_line[-2:]:
         logger.critical(
             f"& is not found at the end of executable line {executable_line}. "
             "These are required for the tether_constructor to allow jobs to "
@@ -86,27 +483,106 @@ def tether_constructor(
     logger.info(f"Staging to {staging_directory}")
     logger.info(f"Calculations per staged job: {calculations_per_staged_job}")
     logger.info(f"Executable line: {executable_line}")
+    if slots is not None:
+        logger.info(f"Concurrent calculations per staged job: {slots}")
     logger.debug(f"Slurm header is {slurm_header_lines}")
-    directories = exhaustive_directory_search(root, filename)
-    chunked_directories = list(chunks(directories, calculations_per_staged_job))
+    if search_kwargs is None:
+        search_kwargs = dict()
+    skipped = Counter()
+    if skip_completed or skip_queued:
+        queued = get_queued_directories() if skip_queued else None
+        if skip_completed:
+            kwargs = dict(search_kwargs)
+            records = iter_job_statuses(
+                root,
+                filename,
+                search_kwargs=kwargs,
+                throttle=kwargs.pop("throttle", None),
+                jobs=jobs,
+                errors=dict(),
+                input_files=input_files,
+                output_files=output_files,
+            )
+        else:
+            records = (
+                {"path": str(dd), "status": None}
+                for dd in iter_directory_search(root, filename, **search_kwargs)
+            )
+        directories = _skip_directories(records, queued, skipped)
+    else:
+        directories = iter_directory_search(root, filename, **search_kwargs)
+
+    logger.info(f"Constructing the chunked directory lines ({packing})")
+    packed, costs = pack(
+        directories, calculations_per_staged_job, packing, cost
+    )
+    for reason, count in skipped.items():
+        logger.info(f"Skipped {count} {reason} calculations")
+    if not packed:
+        logger.warning("No calculations to tether")
+        return
+    if costs is not None:
+        load = load_imbalance(costs)
+        logger.info(
+            f"Predicted load per script: max {load['max']:.4g}, mean "
+            f"{load['mean']:.4g} (imbalance {load['imbalance']:.1%}); "
+            f"predicted idle core time {load['idle']:.1%}"
+        )
+        for ii, chunk_costs in enumerate(costs):
+            logger.debug(f"Script {ii}: predicted load {sum(chunk_costs):.4g}")
 
-    logger.info("Constructing the chunked directory lines")
     submit_script_lines = []
-    for chunk in chunked_directories:
+    target_root = Path(staging_directory)
+    oom = floor(log10(len(packed))) + 1
+    executable = executable_line.rstrip().rstrip("&").rstrip()
+    if mode == "queue":
+        tasks = [dd for chunk in packed for dd in chunk]
+        if costs is not None:
+            task_costs = [xx for chunk in costs for xx in chunk]
+            order = sorted(range(len(tasks)), key=lambda ii: -task_costs[ii])
+            tasks = [tasks[ii] for ii in order]
+        queue_directory = target_root / Path("queue")
+        WorkQueue.create(queue_directory, tasks, executable)
+        logger.info(f"Queued {len(tasks)} calculations in {queue_directory}")
+        for _ in packed:
+            lines = get_worker_lines(
+                slurm_header_lines,
+                queue_directory,
+                slots if slots is not None else calculations_per_staged_job,
+            )
+            submit_script_lines.append(lines)
+    elif mode == "chunk":
+        for ii, chunk in enumerate(packed):
+            chunk_path = target_root / Path(str(ii).zfill(oom), "chunk.json")
+            lines = get_chunk_lines(
+                slurm_header_lines,
+                chunk_path,
+                slots if slots is not None else calculations_per_staged_job,
+            )
+            submit_script_lines.append(lines)
+    else:
+        for chunk in packed:
 
-        # For each chunk, we write a single SLURM script which changes
-        # directories into the one where the executable should be
-        lines = get_file_lines(slurm_header_lines, chunk, executable_line)
-        submit_script_lines.append(lines)
+            # For each chunk, we write a single SLURM script which changes
+            # directories into the one where the executable should be
+            if slots is None:
+                lines = get_file_lines(
+                    slurm_header_lines, chunk, executable_line
+                )
+            else:
+                lines = get_slot_lines(
+                    slurm_header_lines, chunk, executable_line, slots
+                )
+            submit_script_lines.append(lines)
 
     # Now save those jobs to the appropriate directory structure
     L = len(submit_script_lines)
     logger.info(f"Saving {L} submit scripts to staging directory")
-    oom = floor(log10(L)) + 1
-    target_root = Path(staging_directory)
     for ii, submit_script in enumerate(submit_script_lines):
         dd = target_root / Path(str(ii).zfill(oom))
         dd.mkdir(exist_ok=False, parents=True)
+        if mode == "chunk":
+            write_chunk(dd / Path("chunk.json"), packed[ii], executable)
         with open(dd / Path("submit.sbatch"), "w") as f:
             for line in submit_script:
                 f.write(f"{line}\n")
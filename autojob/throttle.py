@@ -0,0 +1,192 @@
+"""Rate limiting of filesystem metadata operations. On shared filesystems such
+as Lustre or NFS, every ``stat``, ``readdir`` and ``open`` is a request to a
+metadata server shared by all users of the cluster. The
+:class:`MetadataThrottle` bounds both the rate and the number of concurrent
+requests autojob makes, and adapts the latter to the latency the filesystem
+is currently delivering."""
+
+from contextlib import contextmanager
+from threading import Condition, Lock
+from time import monotonic, sleep
+
+from autojob import logger
+
+
+class MetadataThrottle:
+    """Limits the rate and concurrency of metadata operations. Every operation
+    is wrapped in the :meth:`op` context manager, which blocks until both a
+    token from the rate limit budget and a concurrency slot are available.
+    Reads of file contents are wrapped in :meth:`read` instead.
+
+    If ``adaptive`` is True, the concurrency limit is tuned by additive
+    increase/multiplicative decrease on the observed latency: as long as the
+    smoothed latency stays within ``tolerance`` times the best latency seen,
+    the filesystem is assumed to have spare capacity and the limit is raised by
+    one slot per window of completed operations. Once latency starts queueing
+    up, the limit is cut back.
+
+    Parameters
+    ----------
+    max_ops_per_second : float, optional
+        The maximum sustained rate of operations. Bursts of up to one second's
+        worth of operations (and at least one operation) are allowed. If
+        None, the rate is not limited.
+    max_concurrency : int, optional
+        The maximum number of operations in flight at once.
+    min_concurrency : int, optional
+        The lower bound for the adaptive concurrency limit.
+    adaptive : bool, optional
+        If False, the concurrency limit is fixed at ``max_concurrency``.
+    tolerance : float, optional
+        The latency inflation (relative to the best latency seen) above which
+        the concurrency limit is decreased.
+    """
+
+    @property
+    def concurrency(self):
+        """The current concurrency limit."""
+
+        return self._limit
+
+    @property
+    def n_ops(self):
+        """The total number of operations performed."""
+
+        return self._n_ops
+
+    def __init__(
+        self,
+        max_ops_per_second=None,
+        max_concurrency=32,
+        min_concurrency=1,
+        adaptive=True,
+        tolerance=2.0,
+    ):
+        self._rate = max_ops_per_second
+        self._max = max_concurrency
+        self._min = min(min_concurrency, max_concurrency)
+        self._adaptive = adaptive
+        self._tolerance = tolerance
+
+        # Token bucket
+        self._token_lock = Lock()
+        # Rates below one operation per second must still accumulate a whole
+        # token
+        self._capacity = max(1.0, max_ops_per_second or 0.0)
+        self._tokens = self._capacity if max_ops_per_second else 0.0
+        self._last_refill = monotonic()
+
+        # Concurrency limit and latency statistics
+        self._condition = Condition()
+        self._limit = self._min if adaptive else self._max
+        self._in_flight = 0
+        self._n_ops = 0
+        self._window = 0
+        self._baseline = None
+        self._ewma = None
+
+    def _take_token(self):
+        """Blocks until the rate limit allows for another operation."""
+
+        if not self._rate:
+            return
+        while True:
+            with self._token_lock:
+                now = monotonic()
+                self._tokens = min(
+                    self._capacity,
+                    self._tokens + (now - self._last_refill) * self._rate,
+                )
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self._rate
+            sleep(wait)
+
+    def _record(self, latency):
+        """Updates the latency statistics and the concurrency limit. Must be
+        called with the condition held."""
+
+        self._n_ops += 1
+        if not self._adaptive:
+            return
+
+        if self._baseline is None:
+            self._baseline = latency
+            self._ewma = latency
+        else:
+            self._ewma = 0.9 * self._ewma + 0.1 * latency
+
+            # The baseline follows the minimum, but drifts slowly towards the
+            # current latency so that a permanently slower filesystem does
+            # not shrink the limit forever
+            self._baseline = min(
+                latency, self._baseline + 0.001 * (self._ewma - self._baseline)
+            )
+
+        self._window += 1
+        if self._window < self._limit:
+            return
+        self._window = 0
+
+        old = self._limit
+        if self._ewma > self._tolerance * self._baseline:
+            self._limit = max(self._min, int(self._limit * 0.75))
+        elif self._in_flight + 1 >= self._limit:
+            # Only grow if the current limit is actually being used
+            self._limit = min(self._max, self._limit + 1)
+        if old != self._limit:
+            logger.debug(
+                f"Metadata concurrency {old} -> {self._limit} (latency "
+                f"{self._ewma * 1e3:.2f} ms, baseline "
+                f"{self._baseline * 1e3:.2f} ms)"
+            )
+            self._condition.notify_all()
+
+    @contextmanager
+    def op(self):
+        """Context manager wrapping a single metadata operation."""
+
+        self._take_token()
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            self._in_flight += 1
+        t0 = monotonic()
+        try:
+            yield
+        finally:
+            latency = monotonic() - t0
+            with self._condition:
+                self._in_flight -= 1
+                self._record(latency)
+                self._condition.notify()
+
+    @contextmanager
+    def read(self):
+        """Context manager wrapping the opening and reading of a file. The
+        open counts against the rate limit like any metadata operation, but
+        the data is served by the storage servers rather than the metadata
+        server, so reads neither hold a concurrency slot (however long they
+        take) nor feed the latency statistics."""
+
+        self._take_token()
+        with self._condition:
+            self._n_ops += 1
+        yield
+
+
+class _NullThrottle:
+    """Stand-in used when no throttling is requested."""
+
+    @contextmanager
+    def op(self):
+        yield
+
+    @contextmanager
+    def read(self):
+        yield
+
+
+NULL_THROTTLE = _NullThrottle()